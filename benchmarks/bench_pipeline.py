@@ -0,0 +1,243 @@
+# Replays notification traces through EventHandlers.receive_notification and reports decoder and pipeline numbers.
+#
+#   python benchmarks/bench_pipeline.py                     # run and compare against baseline.json
+#   python benchmarks/bench_pipeline.py --update-baseline   # store the current numbers as the new baseline
+#
+# Exits with status 1 when a metric regressed by more than --tolerance compared to the stored baseline.
+# Timings are machine dependent - refresh the baseline on the machine that runs the comparison.
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from evseMQTT import Commands, Device, EventHandlers, Frame, FrameDecoder
+import traces
+
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+ROUNDS = 5
+
+class FakeBLEManager:
+    # Records every command the handlers queue for the charger
+    def __init__(self):
+        self.messages = []
+
+    async def message_producer(self, message, *args, **kwargs):
+        self.messages.append(message)
+
+class FakeMQTTSink:
+    # Stands in for MQTTClient.publish_state, recording when each state was handed over
+    def __init__(self, keep=True):
+        self.keep = keep
+        self.published = []
+        self.count = 0
+
+    def __call__(self, identifier, topic, state):
+        self.count += 1
+        if self.keep:
+            self.published.append((time.perf_counter(), identifier, topic, state))
+
+def build_pipeline(keep=True):
+    logger = logging.getLogger("evseMQTT.benchmark")
+    logger.setLevel(logging.WARNING)
+
+    device = Device("AA:BB:CC:DD:EE:FF")
+    commands = Commands(ble_manager=FakeBLEManager(), device=device, logger=logger)
+    sink = FakeMQTTSink(keep)
+    event_handlers = EventHandlers(device=device, commands=commands, logger=logger, callback=sink)
+    return event_handlers, sink
+
+async def replay(event_handlers, notifications):
+    for notification in notifications:
+        await event_handlers.receive_notification("benchmark", notification)
+
+def count_frames(notifications):
+    decoder = FrameDecoder()
+    return sum(1 for notification in notifications for frame in decoder.feed(notification))
+
+def bench_throughput(name, repeat):
+    notifications = traces.load(name)
+    frames = count_frames(notifications)
+
+    async def run():
+        event_handlers, sink = build_pipeline()
+        await replay(event_handlers, traces.load("login"))
+
+        # Best of a few rounds, to keep scheduler noise out of the numbers
+        best = None
+        for attempt in range(ROUNDS):
+            start = time.perf_counter()
+            for i in range(repeat):
+                await replay(event_handlers, notifications)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    elapsed = asyncio.run(run())
+    return {
+        "frames": frames,
+        "frames_per_second": round(frames * repeat / elapsed),
+        "us_per_frame": round(elapsed / (frames * repeat) * 1e6, 2),
+    }
+
+def bench_parsers(repeat):
+    # Time every registered parser against the frames it handles in the traces
+    event_handlers, sink = build_pipeline()
+    samples = {}
+
+    for name in traces.names():
+        decoder = FrameDecoder()
+        for notification in traces.load(name):
+            for view in decoder.feed(notification):
+                frame = Frame(memoryview(bytes(view)))
+                samples.setdefault(frame.cmd, frame)
+
+    results = {}
+    for cmd, frame in sorted(samples.items()):
+        handler = event_handlers.handlers.get(cmd)
+        if handler is None:
+            continue
+
+        elapsed = None
+        for attempt in range(ROUNDS):
+            start = time.perf_counter()
+            for i in range(repeat):
+                handler(frame)
+            elapsed = min(elapsed or float("inf"), time.perf_counter() - start)
+
+        results[f"{cmd}:{handler.__name__}"] = round(elapsed / repeat * 1e6, 2)
+
+    return results
+
+def bench_allocations(name):
+    notifications = traces.load(name)
+    frames = count_frames(notifications)
+
+    async def run():
+        # Nothing is kept by the sink, so retained blocks are what the pipeline itself holds on to
+        event_handlers, sink = build_pipeline(keep=False)
+        await replay(event_handlers, traces.load("login"))
+        await replay(event_handlers, notifications)  # Warm up caches
+
+        gc.collect()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+
+            # Transient memory is measured per notification, so state that grows over the replay doesn't add up
+            transient = 0
+            for notification in notifications:
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+                await event_handlers.receive_notification("benchmark", notification)
+                transient += tracemalloc.get_traced_memory()[1] - current
+
+            gc.collect()
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+
+        blocks = sum(stat.count_diff for stat in after.compare_to(before, "lineno") if stat.count_diff > 0)
+        return blocks, transient
+
+    blocks, transient = asyncio.run(run())
+    return {
+        "retained_blocks_per_frame": round(blocks / frames, 2),
+        "transient_bytes_per_frame": round(transient / frames, 1),
+    }
+
+def bench_end_to_end(repeat):
+    # Time from handing over the first notification of a status frame until the state reaches the sink
+    rng = traces.random.Random(1)
+    notifications = [traces.fragment(traces.status_frame(rng)) for i in range(repeat)]
+
+    async def run():
+        event_handlers, sink = build_pipeline()
+        await replay(event_handlers, traces.load("login"))
+
+        latencies = []
+        for fragments in notifications:
+            published = len(sink.published)
+            start = time.perf_counter()
+            await replay(event_handlers, fragments)
+            if len(sink.published) > published:
+                latencies.append(sink.published[published][0] - start)
+        return latencies
+
+    latencies = sorted(asyncio.run(run()))
+    return {
+        "median_us": round(latencies[len(latencies) // 2] * 1e6, 2),
+        "p95_us": round(latencies[int(len(latencies) * 0.95)] * 1e6, 2),
+    }
+
+def run_all(repeat):
+    return {
+        "throughput": {name: bench_throughput(name, repeat) for name in traces.names() if name != "login"},
+        "parsers_us": bench_parsers(repeat * 50),
+        "allocations": {name: bench_allocations(name) for name in traces.names() if name != "login"},
+        "end_to_end": bench_end_to_end(repeat * 50),
+    }
+
+# Metrics compared against the baseline: key, value, whether higher is better and an absolute slack,
+# so tiny counts don't trip the relative tolerance
+def comparable(results):
+    for name, values in results["throughput"].items():
+        yield f"throughput.{name}.frames_per_second", values["frames_per_second"], True, 0
+    for name, value in results["parsers_us"].items():
+        yield f"parsers_us.{name}", value, False, 1
+    for name, values in results["allocations"].items():
+        # Retained blocks depend on which values the device state happens to hold, so they are only reported
+        yield f"allocations.{name}.transient_bytes_per_frame", values["transient_bytes_per_frame"], False, 128
+    yield "end_to_end.median_us", results["end_to_end"]["median_us"], False, 5
+
+def compare(results, baseline, tolerance):
+    reference = {key: value for key, value, higher_is_better, slack in comparable(baseline)}
+    regressions = []
+
+    for key, value, higher_is_better, slack in comparable(results):
+        if key not in reference or not reference[key] or abs(value - reference[key]) <= slack:
+            continue
+
+        change = (value - reference[key]) / reference[key]
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{key}: {reference[key]} -> {value} ({change:+.0%})")
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="evseMQTT decoder and pipeline benchmarks")
+    parser.add_argument("--repeat", type=int, default=200, help="Number of times each trace is replayed")
+    parser.add_argument("--tolerance", type=float, default=0.35, help="Allowed relative regression against the baseline")
+    parser.add_argument("--update-baseline", action="store_true", help="Store the results as the new baseline")
+    args = parser.parse_args()
+
+    results = run_all(args.repeat)
+    print(json.dumps(results, indent=2))
+
+    if args.update_baseline:
+        with open(BASELINE, "w") as file:
+            json.dump(results, file, indent=2)
+            file.write("\n")
+        print(f"Baseline written to {BASELINE}")
+        return 0
+
+    if not BASELINE.exists():
+        print("No baseline found - run with --update-baseline first")
+        return 0
+
+    with open(BASELINE) as file:
+        regressions = compare(results, json.load(file), args.tolerance)
+
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
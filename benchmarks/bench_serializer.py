@@ -0,0 +1,72 @@
+# Compares the cost of encoding state payloads: plain json.dumps (as MQTTClient used to) against StateSerializer.
+#
+#   python benchmarks/bench_serializer.py
+import json
+import sys
+import time
+from functools import partial
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from evseMQTT import Device, FrameDecoder, Frame, Parsers, StateSerializer
+from evseMQTT.serializer import orjson
+import traces
+
+ROUNDS = 5
+IDENTIFIER = "3837363534333231"
+
+def states(count):
+    # Realistic charge and config states, one new charge snapshot per status frame like the live pipeline
+    device = Device("AA:BB:CC:DD:EE:FF")
+    device.config = {"device_name": "ACP#Garage", "language": "English", "temperature_unit": "Celcius", "charge_amps": 16, "system_time": "2024-01-01T12:00:00", "system_time_raw": 1704110400}
+
+    rng = traces.random.Random(3)
+    result = []
+    for i in range(count):
+        decoder = FrameDecoder()
+        for view in decoder.feed(traces.status_frame(rng)):
+            device.charge = Parsers.single_ac_status(Frame(view))
+        result.append(("charge", device.charge))
+        if i % 10 == 0:
+            result.append(("config", device.config))
+    return result
+
+def measure(encode, samples):
+    best = None
+    size = 0
+    for attempt in range(ROUNDS):
+        start = time.perf_counter()
+        size = 0
+        for topic, state in samples:
+            size += len(encode(topic, state))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(samples) * 1e6, size / len(samples)
+
+def main():
+    samples = states(2000)
+    # Republishing unchanged snapshots, as happens for max_silence refreshes and after reconnects
+    republished = [sample for sample in samples[:50] for i in range(40)]
+
+    candidates = {
+        "json.dumps (previous)": lambda: lambda topic, state: json.dumps(state).encode('utf-8'),
+        "StateSerializer(json)": lambda: partial(StateSerializer("json").encode, IDENTIFIER),
+    }
+    if orjson:
+        candidates["StateSerializer(orjson)"] = lambda: partial(StateSerializer("orjson").encode, IDENTIFIER)
+
+    workloads = {
+        "charge": [sample for sample in samples if sample[0] == "charge"],
+        "config": [sample for sample in samples if sample[0] == "config"] * 10,
+        "republish": republished,
+    }
+
+    print(f"{'encoder':28} {'workload':10} {'us/publish':>10} {'bytes/publish':>14}")
+    for name, factory in candidates.items():
+        for workload, items in workloads.items():
+            us, size = measure(factory(), items)
+            print(f"{name:28} {workload:10} {us:10.2f} {size:14.1f}")
+
+if __name__ == "__main__":
+    main()
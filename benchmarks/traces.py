@@ -0,0 +1,93 @@
+# Notification traces used by the benchmarks.
+#
+# A trace is a text file with one BLE notification per line, hex encoded, exactly as it was handed to
+# EventHandlers.receive_notification. Lines starting with # are comments. Traces captured from a real
+# charger (the hex from the "Notification from ..." debug lines) can be dropped into traces/ as is.
+#
+# Running this file regenerates the synthetic traces shipped with the repository.
+import random
+import struct
+from pathlib import Path
+
+TRACES = Path(__file__).resolve().parent / "traces"
+SERIAL = 0x3132333435363738
+NOTIFICATION_SIZE = 20  # Default ATT MTU leaves 20 bytes per notification
+
+def build_frame(cmd, data=b'', serial=SERIAL, password=b'123456'):
+    length = 25 + len(data)
+    packet = bytearray(b'\x06\x01') + struct.pack('>HB', length, 0) + struct.pack('<Q', serial) + password + struct.pack('>H', cmd) + bytes(data)
+    packet += struct.pack('>H', sum(packet) % 65536) + b'\x0f\x02'
+    return bytes(packet)
+
+def login_frame(cmd):
+    data = bytes([10]) + b'BESEN'.ljust(15, b'\x00') + b'\x00' + b'BS20'.ljust(15, b'\x00') + b'\x00' + b'BS20-HW-V1.0'.ljust(16, b'\x00')
+    data += struct.pack('>IB', 11000, 16) + b'evse'.ljust(15, b'\x00')
+    return build_frame(cmd, data)
+
+def status_frame(rng, phases=3):
+    voltage = 2300 + rng.randrange(-30, 30)
+    amperage = 1550 + rng.randrange(-40, 40)
+    data = struct.pack('>BHHIIHHBBBB', 1, voltage, amperage, 1234567 + rng.randrange(1000), 2000, 22450 + rng.randrange(20), 255, 0, 4, 1, 14)
+    data += bytes(4)
+    if phases == 3:
+        data += struct.pack('>HHHH', voltage + 5, amperage, voltage - 5, amperage)
+        data += bytes(8)
+    return build_frame(13, data)
+
+def config_frames():
+    return [
+        build_frame(262, b'BS20-HW-V1.0'.ljust(16, b'\x00') + b'BS20-SW-V2.3'.ljust(16, b'\x00') + struct.pack('>I', 3)),
+        build_frame(263, bytes([1, 16])),
+        build_frame(264, bytes([1]) + b'ACP#Garage'.ljust(31, b'\x00')),
+        build_frame(271, bytes([1, 1])),
+        build_frame(274, bytes([1, 1])),
+        build_frame(257, bytes([1]) + struct.pack('>I', 1700000000)),
+    ]
+
+def fragment(stream, size=NOTIFICATION_SIZE):
+    return [stream[i:i + size] for i in range(0, len(stream), size)]
+
+def generate():
+    rng = random.Random(2024)
+    traces = {}
+
+    traces["login"] = ("Login beacon, login response and the config replies that follow it",
+                       fragment(login_frame(1) + login_frame(2) + b''.join(config_frames())))
+
+    traces["status_fragmented"] = ("3-phase status frames, each split over several 20 byte notifications",
+                                   fragment(b''.join(status_frame(rng) for i in range(50))))
+
+    # Several frames per notification, cut at arbitrary points
+    stream = b''.join(status_frame(rng, phases=rng.choice([1, 3])) for i in range(50))
+    notifications = []
+    while stream:
+        size = rng.randrange(60, 200)
+        notifications.append(stream[:size])
+        stream = stream[size:]
+    traces["multi_frame"] = ("Back-to-back status frames, several per notification", notifications)
+
+    # Corrupted checksums and line noise between valid frames
+    stream = b''
+    for i in range(50):
+        frame = bytearray(status_frame(rng))
+        if i % 5 == 0:
+            frame[30] ^= 0xFF
+        stream += bytes(frame)
+        if i % 7 == 0:
+            stream += bytes(rng.randrange(256) for j in range(rng.randrange(1, 12)))
+    traces["bad_checksum"] = ("Status frames with every fifth checksum broken and line noise in between", fragment(stream))
+
+    for name, (description, notifications) in traces.items():
+        with open(TRACES / f"{name}.trace", "w") as file:
+            file.write(f"# {description}\n")
+            file.writelines(f"{notification.hex()}\n" for notification in notifications)
+
+def load(name):
+    with open(TRACES / f"{name}.trace") as file:
+        return [bytearray.fromhex(line.strip()) for line in file if line.strip() and not line.startswith('#')]
+
+def names():
+    return sorted(path.stem for path in TRACES.glob("*.trace"))
+
+if __name__ == "__main__":
+    generate()
@@ -18,6 +18,42 @@ if [ -n "${RSSI}" ]; then
   EXTRA_ARGS="${EXTRA_ARGS} --rssi"
 fi
 
+if [ -n "${CHANGE_ONLY}" ]; then
+  EXTRA_ARGS="${EXTRA_ARGS} --change_only"
+fi
+
+if [ -n "${MQTT_VERSION}" ]; then
+  EXTRA_ARGS="${EXTRA_ARGS} --mqtt_version ${MQTT_VERSION}"
+fi
+
+if [ -n "${DISCOVERY_MODE}" ]; then
+  EXTRA_ARGS="${EXTRA_ARGS} --discovery_mode ${DISCOVERY_MODE}"
+fi
+
+if [ -n "${STATE_DIR}" ]; then
+  EXTRA_ARGS="${EXTRA_ARGS} --state_dir ${STATE_DIR}"
+fi
+
+if [ -n "${CHARGERS}" ]; then
+  EXTRA_ARGS="${EXTRA_ARGS} --chargers ${CHARGERS}"
+fi
+
+if [ -n "${ADAPTERS}" ]; then
+  EXTRA_ARGS="${EXTRA_ARGS} --adapters ${ADAPTERS}"
+fi
+
+if [ -n "${ADAPTER_CAPACITY}" ]; then
+  EXTRA_ARGS="${EXTRA_ARGS} --adapter_capacity ${ADAPTER_CAPACITY}"
+fi
+
+if [ -n "${STATS_INTERVAL}" ]; then
+  EXTRA_ARGS="${EXTRA_ARGS} --stats_interval ${STATS_INTERVAL}"
+fi
+
+if [ -n "${SPOOL_TAIL}" ]; then
+  EXTRA_ARGS="${EXTRA_ARGS} --spool_tail"
+fi
+
 if [ -n "${SYS_MODULE_TO_RELOAD}" ]; then
     echo "sys module reload enabled for: ${SYS_MODULE_TO_RELOAD}"
     if [ -d /lib/modules/ ]; then
@@ -8,4 +8,19 @@ from .parsers import Parsers
 from .mqttpayloads import MQTTPayloads
 from .mqttclient import MQTTClient
 from .mqttcallback import MQTTCallback
-from .commands import Commands
\ No newline at end of file
+from .publish_filter import PublishFilter
+from .publish_coalescer import PublishCoalescer
+from .serializer import StateSerializer
+from .state_store import StateStore
+from .device_cache import DeviceCache
+from .spool import Spool
+from .scanner import Scanner
+from .adapter_pool import AdapterPool
+from .commands import Commands
+from .command_encoder import CommandEncoder
+from .command_queue import CommandQueue
+from .supervisor import Supervisor
+from .response_tracker import ResponseTracker
+from .frame_decoder import FrameDecoder
+from .frame import Frame
+from .schema import Schema, Layout
\ No newline at end of file
@@ -0,0 +1,128 @@
+import asyncio
+import os
+import time
+from bleak import BleakScanner, BleakError
+from .scanner import Scanner
+
+class AdapterPool:
+    # Places chargers on the Bluetooth adapters of the host. An adapter only holds a few GATT connections
+    # reliably, so each takes up to capacity chargers. A charger goes to the adapter that hears it best among
+    # those with room left - ties, and chargers no adapter heard, go to the least loaded one. What each adapter
+    # hears is sampled by a short scan on all of them at once.
+    #
+    # After max_failures failed attempts in a row a charger is moved: the adapter it failed on is avoided until
+    # it connected again, or until it failed on every adapter and the list starts over.
+    SYSFS = "/sys/class/bluetooth"
+
+    def __init__(self, logger, adapters=None, capacity=4, max_failures=3, survey_window=5, survey_age=60):
+        self.logger = logger
+        self.adapters = adapters or self.discover() or [None]  # None is the default adapter
+        self.capacity = capacity
+        self.max_failures = max_failures
+        self.survey_window = survey_window
+        self.survey_age = survey_age
+        self.on_change = None  # Called when a charger was placed or moved
+
+        self.scanners = {adapter: Scanner(logger, adapter=adapter) for adapter in self.adapters}
+        self.signal = {adapter: {} for adapter in self.adapters}  # adapter -> address -> RSSI of the last survey
+        self.surveyed = None
+        self.assigned = {}  # address -> adapter
+        self.avoid = {}  # address -> adapters it failed on
+        self.moves = {adapter: 0 for adapter in self.adapters}  # Chargers moved away from each adapter
+        self.lock = asyncio.Lock()
+
+    @classmethod
+    def discover(cls):
+        # BlueZ lists its adapters as hci0, hci1 ... - connections show up there too, as hci0:<handle>
+        try:
+            names = [name for name in os.listdir(cls.SYSFS) if name.startswith("hci") and name[3:].isdigit()]
+        except OSError:
+            return []
+
+        return sorted(names, key=lambda name: int(name[3:]))
+
+    def label(self, adapter):
+        return adapter or "default"
+
+    def load(self, adapter):
+        return sum(1 for assigned in self.assigned.values() if assigned == adapter)
+
+    def stats(self):
+        return {
+            self.label(adapter): {
+                "chargers": sorted(address for address, assigned in self.assigned.items() if assigned == adapter),
+                "load": self.load(adapter),
+                "capacity": self.capacity,
+                "moves": self.moves[adapter],
+            }
+            for adapter in self.adapters
+        }
+
+    async def survey(self, adapters):
+        async def sample(adapter):
+            try:
+                found = await BleakScanner.discover(timeout=self.survey_window, return_adv=True, **({"adapter": adapter} if adapter else {}))
+            except BleakError as e:
+                self.logger.warning(f"BleakError while scanning on {self.label(adapter)}: {e}")
+                return
+
+            self.signal[adapter] = {address: advertisement.rssi for address, (device, advertisement) in found.items()}
+
+            # Found with this adapter, so connecting through it needs no further scan
+            for address, (device, advertisement) in found.items():
+                if device.name and "ACP#" in device.name:
+                    self.scanners[adapter].devices[address] = device
+
+        self.logger.debug(f"Surveying adapters {', '.join(self.label(adapter) for adapter in adapters)}")
+        await asyncio.gather(*(sample(adapter) for adapter in adapters))
+        self.surveyed = time.monotonic()
+
+    async def place(self, address):
+        # The adapter for the next attempt to connect the charger
+        async with self.lock:
+            if address in self.assigned:
+                return self.assigned[address]
+
+            candidates = [adapter for adapter in self.adapters if adapter not in self.avoid.get(address, ())]
+            if not candidates:
+                self.avoid.pop(address, None)
+                candidates = list(self.adapters)
+
+            heard = any(address in self.signal[adapter] for adapter in candidates)
+            if len(candidates) > 1 and (self.surveyed is None or (not heard and time.monotonic() - self.surveyed > self.survey_age)):
+                await self.survey(candidates)
+
+            def score(adapter):
+                rssi = self.signal[adapter].get(address)
+                return (self.load(adapter) < self.capacity, rssi is not None, rssi or 0, -self.load(adapter))
+
+            adapter = max(candidates, key=score)
+            if self.load(adapter) >= self.capacity:
+                self.logger.warning(f"All adapters are at capacity - placing {address} on {self.label(adapter)} anyway")
+
+            self.assigned[address] = adapter
+            if len(self.adapters) > 1:
+                self.logger.info(f"Placed {address} on {self.label(adapter)}, RSSI {self.signal[adapter].get(address)}, {self.load(adapter)}/{self.capacity} chargers")
+
+        if self.on_change:
+            self.on_change()
+
+        return adapter
+
+    def failed(self, address, failures):
+        # Called before an attempt with the number of failed attempts in a row - returns whether the charger moves
+        if len(self.adapters) < 2 or not failures or failures % self.max_failures or address not in self.assigned:
+            return False
+
+        adapter = self.assigned.pop(address)
+        self.avoid.setdefault(address, set()).add(adapter)
+        self.moves[adapter] += 1
+        self.logger.warning(f"{address} failed {failures} times on {self.label(adapter)} - moving it to another adapter")
+
+        if self.on_change:
+            self.on_change()
+
+        return True
+
+    def connected(self, address):
+        self.avoid.pop(address, None)
@@ -2,22 +2,28 @@ import asyncio
 import logging
 from bleak import BleakScanner, BleakClient, BleakError
 from .constants import Constants
+from .command_queue import CommandQueue
+from .scanner import Scanner
 
 class BLEManager:
-    def __init__(self, event_handler, logger, callback=None):
+    def __init__(self, event_handler, logger, callback=None, scanner=None):
         self.connected_devices = {}
         self.available_devices = {}
         self.connectiondata = {}
         self.logger = logger  # Use the centralized logger
-        self.queue = asyncio.Queue(5)
+        self.queue = CommandQueue()  # Sent by priority, pending writes of the same setting are coalesced
         self.callback = callback
         self.event_handler = event_handler  # Use the EventHandlers instance passed from MainManager
+        self.scanner = scanner or Scanner(logger)  # Long-lived scanner, tracks the RSSI while connected
+        self.adapter = None  # Bluetooth adapter to connect through, None for the default one
+        self.adapter_changed = asyncio.Event()
         self.last_message_time = asyncio.get_event_loop().time()
         self.message_timeout = 35  # 35 seconds timeout for message reception
-        self.max_retries = 5  # Maximum number of retries for connection
+        self.link_lost = asyncio.Event()  # Set when the charger disconnected or a write failed
         
         self.write_uuid = ""
         self.read_uuid = ""
+        self.known_uuids = {}  # address -> (write uuid, read uuid) from the device cache
 
         # Ensure bleak does not go bananas, if we set logging to DEBUG
         self.logger_bleak = logging.getLogger("bleak")
@@ -41,52 +47,111 @@ class BLEManager:
             return self.available_devices
 
         except BleakError as e:
-            await self.manager.exit_with_error(f"BleakError during scanning: {e}")
+            self.logger.error(f"BleakError during scanning: {e}")
+            raise
             
+    def use_adapter(self, adapter, scanner):
+        # A BLEDevice belongs to the adapter it was found with - the cached one can't be used through another one
+        if adapter == self.adapter and scanner is self.scanner:
+            return
+
+        self.logger.debug(f"Using adapter {adapter or 'default'}")
+        self.adapter = adapter
+        self.scanner = scanner
+        self.connectiondata.clear()
+        self.adapter_changed.set()
+
+    def adapter_args(self):
+        return {"adapter": self.adapter} if self.adapter else {}
+
+    async def find_device(self, address, timeout=10.0):
+        # The BLEDevice from the last session or seen by the scanner - connecting to it needs no scan
+        device = self.connectiondata.get(address) or self.scanner.devices.get(address)
+        if device is not None:
+            return device
+
+        # Targeted discovery - returns as soon as the charger advertises
+        self.logger.info(f"Looking for {address}...")
+        rssi = {}
+
+        def match(device, advertisement):
+            if device.address.upper() != address.upper():
+                return False
+            rssi[address] = advertisement.rssi
+            return True
+
+        device = await BleakScanner.find_device_by_filter(match, timeout=timeout, **self.adapter_args())
+        if device is not None:
+            self.connectiondata[address] = device
+            self.event_handler.device.config = {"rssi": rssi[address]}
+
+        return device
+
     async def connect_device(self, address):
-        if address in self.available_devices:
-            for attempt in range(self.max_retries):
-                self.logger.info(f"Connecting to {address}, attempt {attempt + 1}")
-                try:
-                    client = BleakClient(address, timeout=65.0)
-                    await client.connect()
-
-                    services = client.services
-                    service_uuids = [service.uuid for service in services]
-
-                    # Check service UUIDs to determine board type
-                    if any(uuid.startswith("0000ffe5-") or uuid.startswith("0000ffe0-") for uuid in service_uuids):
-                        self.logger.debug(f"Device ({address}) identified as new revision")
-                        self.write_uuid = Constants.NEW_BOARD_WRITE_UUID
-                        self.read_uuid = Constants.NEW_BOARD_READ_UUID
-                    elif any(uuid.startswith("0003cdd0-") for uuid in service_uuids):
-                        self.logger.debug(f"Device ({address}) identified as other revision")
-                        self.write_uuid = Constants.REV_WRITE_UUID
-                        self.read_uuid = Constants.REV_READ_UUID
-                        self.event_handler.device.fallback = True
-                    else:
-                        self.logger.debug(f"Device ({address}) identified as old revision")
-                        self.write_uuid = Constants.WRITE_UUID
-                        self.read_uuid = Constants.READ_UUID
-
-                    self.connected_devices[address] = client
-                    self.logger.info(f"Connected to {address}")
-                    await self.start_notifications(address, self.read_uuid)
-                                        
-                    self.event_handler.device.config = {"rssi": self.available_devices[address][1].rssi}
-                    self._schedule_reconnect_check()
-                    return True
-                except BleakError as e:
-                    self.logger.error(f"Attempt {attempt + 1} failed with BleakError: {e}")
-                except Exception as e:
-                    self.logger.error(f"Attempt {attempt + 1} failed with error: {e}")
-                await asyncio.sleep(2)  # Wait a bit before retrying
-            await self.manager.exit_with_error(f"Failed to connect to {address} after {self.max_retries} attempts")
+        # One attempt - retries and backoff are up to the supervisor
+        try:
+            device = await self.find_device(address)
+        except BleakError as e:
+            self.logger.error(f"BleakError while looking for {address}: {e}")
             return False
-        else:
-            await self.manager.exit_with_error(f"Device {address} not found")
+
+        if device is None:
+            self.logger.warning(f"Device {address} not found")
             return False
 
+        self.logger.info(f"Connecting to {address}")
+        try:
+            client = BleakClient(device, timeout=65.0, disconnected_callback=self._handle_disconnect, **self.adapter_args())
+            await client.connect()
+
+            services = client.services
+            service_uuids = [service.uuid for service in services]
+            known = self.known_uuids.get(address)
+
+            # Board type from the device cache, if the characteristics are still there
+            if known and all(services.get_characteristic(uuid) is not None for uuid in known):
+                self.logger.debug(f"Device ({address}) revision taken from the device cache")
+                self.write_uuid, self.read_uuid = known
+            # Check service UUIDs to determine board type
+            elif any(uuid.startswith("0000ffe5-") or uuid.startswith("0000ffe0-") for uuid in service_uuids):
+                self.logger.debug(f"Device ({address}) identified as new revision")
+                self.write_uuid = Constants.NEW_BOARD_WRITE_UUID
+                self.read_uuid = Constants.NEW_BOARD_READ_UUID
+            elif any(uuid.startswith("0003cdd0-") for uuid in service_uuids):
+                self.logger.debug(f"Device ({address}) identified as other revision")
+                self.write_uuid = Constants.REV_WRITE_UUID
+                self.read_uuid = Constants.REV_READ_UUID
+                self.event_handler.device.fallback = True
+            else:
+                self.logger.debug(f"Device ({address}) identified as old revision")
+                self.write_uuid = Constants.WRITE_UUID
+                self.read_uuid = Constants.READ_UUID
+
+            self.connected_devices[address] = client
+            self.logger.info(f"Connected to {address}")
+            self.link_lost.clear()
+            self.last_message_time = asyncio.get_event_loop().time()
+            self.event_handler.connected()
+            await self.start_notifications(address, self.read_uuid)
+
+            if address in self.available_devices:
+                self.event_handler.device.config = {"rssi": self.available_devices[address][1].rssi}
+            return True
+        except BleakError as e:
+            self.logger.error(f"Connecting to {address} failed with BleakError: {e}")
+        except Exception as e:
+            self.logger.error(f"Connecting to {address} failed with error: {e}")
+
+        # The cached device may be stale - look it up again on the next attempt
+        self.connectiondata.pop(address, None)
+        self.scanner.devices.pop(address, None)
+        await self.disconnect_device(address)
+        return False
+
+    def _handle_disconnect(self, client):
+        self.logger.warning(f"Device {client.address} disconnected")
+        self.link_lost.set()
+
     async def start_notifications(self, address, characteristic_uuid):
         if address in self.connected_devices:
             self.logger.debug(f"Starting notifications for {characteristic_uuid} on {address}")
@@ -95,9 +160,8 @@ class BLEManager:
             self.logger.debug(f"Notifications started for {characteristic_uuid} on {address}")
             return True
         else:
-            self.logger.error(f"Device {address} not connected")
-            await self.manager.exit_with_error(f"Device {address} not connected")
-            return False
+            # The link went down - connecting fails, and the supervisor tries again
+            raise BleakError(f"Device {address} not connected")
 
     async def _handle_notification_wrapper(self, sender, data):
         self.last_message_time = asyncio.get_event_loop().time()
@@ -106,17 +170,20 @@ class BLEManager:
     async def disconnect_device(self, address):
         if address in self.connected_devices:
             self.logger.info(f"Disconnecting from {address}...")
-            client = self.connected_devices[address]
+            client = self.connected_devices.pop(address)
 
-            if client.is_connected:
-                await client.stop_notify(self.read_uuid)
+            # The link may already be gone - the client is released either way
+            try:
+                if client.is_connected:
+                    await asyncio.wait_for(client.stop_notify(self.read_uuid), 5)
+                await asyncio.wait_for(client.disconnect(), 10)
+            except (BleakError, asyncio.TimeoutError, EOFError) as e:
+                self.logger.warning(f"Disconnecting from {address} failed: {e}")
 
-            await client.disconnect()
-            del self.connected_devices[address]
             self.logger.info(f"Disconnected from {address}")
             return True
         else:
-            self.logger.error(f"Device {address} not connected")
+            self.logger.debug(f"Device {address} not connected")
             return False
 
     async def read_characteristic(self, address, characteristic_uuid):
@@ -127,9 +194,7 @@ class BLEManager:
             self.logger.debug(f"Read data: {data}")
             return data
         else:
-            self.logger.error(f"Device {address} not connected")
-            await self.manager.exit_with_error(f"Device {address} not connected")
-            return None
+            raise BleakError(f"Device {address} not connected")
 
     async def write_characteristic(self, address, characteristic_uuid, data):
         if address in self.connected_devices:
@@ -139,37 +204,51 @@ class BLEManager:
             self.logger.debug(f"Write complete")
             return True
         else:
-            await self.manager.exit_with_error(f"Device {address} not connected")
-            return False
+            # The link went down - the consumer reports it to the supervisor
+            raise BleakError(f"Device {address} not connected")
 
-    async def heartbeat(self, interval, address):
+    async def track_rssi(self, address):
+        # RSSI from the advertisements picked up by the scanner - published only when it changed noticeably.
+        # Follows the charger to the scanner of another adapter when it is moved.
         while True:
-            self.logger.debug(f"Retrieving RSSI for device {address}")
-            rssi = await self.scan(address)
-            self.event_handler.device.config = {"rssi": rssi}
-            await asyncio.sleep(interval)
+            self.adapter_changed.clear()
+            scanner = self.scanner
+            scanner.watch(address, self.rssi_changed)
+            serve = asyncio.ensure_future(scanner.serve())
+            moved = asyncio.ensure_future(self.adapter_changed.wait())
+            try:
+                await asyncio.wait({serve, moved}, return_when=asyncio.FIRST_COMPLETED)
+                if serve.done():
+                    return serve.result()
+            finally:
+                serve.cancel()
+                moved.cancel()
+                scanner.unwatch(address)
+
+    def rssi_changed(self, rssi):
+        self.logger.debug(f"RSSI changed to {rssi}")
+        self.event_handler.device.config = {"rssi": rssi}
+        self.event_handler.forward("config")
 
     async def message_consumer(self, address, characteristic_uuid):
+        # Runs while the link is up - the supervisor starts one per connection and cancels it on teardown
         while True:
-            if not self.connected_devices.get(address):
-                self.logger.warning(f"Device {address} not connected. Attempting to reconnect...")
-                await self.connect_device(address)
-                await asyncio.sleep(1)
-                continue
-
             message = await self.queue.get()
-            await self.write_characteristic(address, characteristic_uuid, message)
-            self.queue.task_done()
+            try:
+                await self.write_characteristic(address, characteristic_uuid, message)
+            except Exception as e:
+                self.logger.error(f"Writing to {address} failed: {e}")
+                # The frame is gone - whoever waits on its response learns why instead of waiting for the teardown
+                self.event_handler.commands.responses.fail(message, ConnectionError(f"Writing to {address} failed: {e}"))
+                self.link_lost.set()
+                return
+            finally:
+                self.queue.task_done()
 
     async def message_producer(self, message):
-        await self.queue.put(message)
+        # Never waits - the queue has room for every class
+        self.queue.put_nowait(message)
 
-    def _schedule_reconnect_check(self):
-        asyncio.get_event_loop().call_later(self.message_timeout, self._check_reconnect)
-
-    def _check_reconnect(self):
-        if asyncio.get_event_loop().time() - self.last_message_time > self.message_timeout:
-            self.logger.warning(f"No message received in the last {self.message_timeout} seconds. Requesting manager to restart.")
-            asyncio.create_task(self.manager.restart_run())
-        else:
-            self._schedule_reconnect_check()
\ No newline at end of file
+    async def message_burst(self, messages):
+        # Queued as one unit and sent in the order given
+        self.queue.put_burst(messages)
\ No newline at end of file
@@ -0,0 +1,44 @@
+import struct
+
+class CommandEncoder:
+    PREFIX = struct.Struct('>2sHB8s6s')  # header, length, reserved, serial, password
+    COMMAND = struct.Struct('>H')
+    TRAILER = struct.Struct('>H2s')  # checksum, end-bytes
+
+    def __init__(self, serial, password):
+        self.serial = serial
+        self.password = password
+
+        # Everything but the length is fixed for the session, so the prefix and its checksum are computed once
+        self.prefix = self.PREFIX.pack(b'\x06\x01', 0, 0, struct.pack('<Q', int(serial)), password.encode('ascii'))
+        self.prefix_checksum = sum(self.prefix)
+
+        # Fully built frames for commands that never change during a session
+        self.frames = {}
+
+    def encode(self, cmd, payload=b''):
+        length = 25 + len(payload)
+
+        packet = bytearray(length)
+        packet[:19] = self.prefix
+        packet[2] = length >> 8
+        packet[3] = length & 0xFF
+        self.COMMAND.pack_into(packet, 19, cmd)
+        packet[21:21 + len(payload)] = payload
+
+        # Only the length, command and payload have to be added to the precomputed checksum
+        checksum = (self.prefix_checksum + packet[2] + packet[3] + packet[19] + packet[20] + sum(payload)) % 0xFFFF
+        self.TRAILER.pack_into(packet, 21 + len(payload), checksum, b'\x0f\x02')
+
+        return packet
+
+    def static(self, cmd, payload=b''):
+        # payload has to be hashable (bytes) - the frame is built on first use and reused afterwards
+        key = (cmd, payload)
+        frame = self.frames.get(key)
+
+        if frame is None:
+            frame = bytes(self.encode(cmd, payload))
+            self.frames[key] = frame
+
+        return frame
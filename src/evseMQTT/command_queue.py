@@ -0,0 +1,229 @@
+import asyncio
+import collections
+import time
+
+class CommandQueue:
+    # Outbound queue of command frames that knows what the frames do.
+    #
+    # Frames are sent by priority class - safety first, bulk reads last - and in order within a class. Charge start
+    # and stop share the safety class, so a stop is never sent ahead of a start queued before it.
+    # A write of a setting that is still pending is replaced by the newer value in place, and a read that is
+    # already pending isn't queued twice. Writes are in a higher class than reads, so a pending read is sent
+    # after a pending write of the same setting and picks up the new value.
+    #
+    # A burst is queued as one entry in the class of its most urgent frame, and sent in the order given - frames of
+    # a higher class may still go in between. Nothing is coalesced into a burst, and a single frame isn't coalesced
+    # across a burst touching the same setting, so a burst's writes are never reordered against other writes.
+    #
+    # Producers never wait: put() returns right away. Only the bulk class has a limit - when it is full, a new read
+    # is rejected rather than dropping a frame already queued. An unanswered read is sent again by the response
+    # tracker anyway.
+    #
+    # Drop-in for the asyncio.Queue used before: put, put_nowait, get, task_done, join, qsize, empty.
+
+    CLASSES = ("safety", "protocol", "control", "bulk")
+    LIMITS = {"bulk": 32}
+
+    SAFETY = {32775, 32776}  # charge start and stop
+    PROTOCOL = {32769, 32770, 32771, 33026}  # login, heartbeat, password
+
+    # Settings commands carry the action (1 = set, 2 = read) in the first payload byte,
+    # the LCD brightness command in the second one (2 = set)
+    SETTINGS = {33025, 33028, 33029, 33031, 33032, 33039, 33042}
+    LCD_BRIGHTNESS = 33122
+
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize  # Kept for compatibility - the per class limits apply instead
+        self.pending = {name: collections.deque() for name in self.CLASSES}  # class -> [cmd, kind, frame, queued at], [None, "burst", [frames], queued at]
+        self.unfinished = 0
+        self.not_empty = asyncio.Event()
+        self.finished = asyncio.Event()
+        self.finished.set()
+
+        # Counters
+        self.enqueued = 0
+        self.replaced = 0  # Writes replaced by a newer value before they were sent
+        self.deduplicated = 0  # Reads dropped because the same read was pending
+        self.metrics = {name: {"enqueued": 0, "sent": 0, "dropped": 0, "max_depth": 0, "wait_total": 0.0, "wait_max": 0.0} for name in self.CLASSES}
+
+    @classmethod
+    def classify(cls, frame):
+        # Returns (cmd, "set" | "get") for frames that may be coalesced, (cmd, None) otherwise
+        cmd = (frame[19] << 8) | frame[20]
+
+        if cmd in cls.SETTINGS and len(frame) > 25:
+            return cmd, "set" if frame[21] == 1 else "get"
+
+        if cmd == cls.LCD_BRIGHTNESS and len(frame) > 26:
+            return cmd, "set" if frame[22] == 2 else "get"
+
+        return cmd, None
+
+    @classmethod
+    def priority(cls, cmd, kind):
+        if cmd in cls.SAFETY:
+            return "safety"
+        if cmd in cls.PROTOCOL:
+            return "protocol"
+        if kind == "set" and cmd != 33025:
+            return "control"
+        # Reads, time sync and anything else
+        return "bulk"
+
+    @staticmethod
+    def size(pending):
+        return sum(len(entry[2]) if entry[1] == "burst" else 1 for entry in pending)
+
+    @classmethod
+    def touches(cls, entry, cmd):
+        # Whether a burst entry holds a frame of cmd
+        return entry[1] == "burst" and any(cls.classify(frame)[0] == cmd for frame in entry[2])
+
+    def qsize(self):
+        return sum(self.size(pending) for pending in self.pending.values())
+
+    def empty(self):
+        return not any(self.pending.values())
+
+    def full(self):
+        return False
+
+    def stats(self):
+        classes = {}
+        for name, metrics in self.metrics.items():
+            classes[name] = {
+                "depth": self.size(self.pending[name]),
+                "max_depth": metrics["max_depth"],
+                "enqueued": metrics["enqueued"],
+                "sent": metrics["sent"],
+                "dropped": metrics["dropped"],
+                "wait_avg_ms": round(metrics["wait_total"] / metrics["sent"] * 1000, 1) if metrics["sent"] else 0.0,
+                "wait_max_ms": round(metrics["wait_max"] * 1000, 1),
+            }
+
+        return {"pending": self.qsize(), "enqueued": self.enqueued, "replaced": self.replaced, "deduplicated": self.deduplicated, "classes": classes}
+
+    def coalesce(self, cmd, kind, frame, pending):
+        # Returns True when the frame was merged into a pending entry of its class
+        if kind == "set":
+            for entry in reversed(pending):
+                if self.touches(entry, cmd):
+                    return False
+                if entry[0] == cmd and entry[1] == "set":
+                    entry[2] = frame
+                    self.replaced += 1
+                    return True
+
+        # Time sync writes and reads share the bulk class - a read queued before a write doesn't count
+        elif kind == "get":
+            for entry in reversed(pending):
+                if self.touches(entry, cmd):
+                    return False
+                if entry[0] != cmd:
+                    continue
+                if entry[1] == "set":
+                    return False
+                self.deduplicated += 1
+                return True
+
+        return False
+
+    def put_nowait(self, frame):
+        # Returns False when the frame was rejected because its class is full
+        cmd, kind = self.classify(frame)
+        name = self.priority(cmd, kind)
+        pending = self.pending[name]
+
+        if kind and self.coalesce(cmd, kind, frame, pending):
+            return True
+
+        limit = self.LIMITS.get(name)
+        if limit and len(pending) >= limit:
+            self.metrics[name]["dropped"] += 1
+            return False
+
+        pending.append([cmd, kind, frame, time.monotonic()])
+        self.enqueued += 1
+        self.unfinished += 1
+        self.finished.clear()
+        self.not_empty.set()
+
+        metrics = self.metrics[name]
+        metrics["enqueued"] += 1
+        metrics["max_depth"] = max(metrics["max_depth"], self.size(pending))
+        return True
+
+    def put_burst(self, frames):
+        # Queued as one unit, never rejected - the class of the most urgent frame is the first one in CLASSES.
+        # A single frame is no burst, and may be coalesced like any other
+        if len(frames) == 1:
+            self.put_nowait(frames[0])
+        if len(frames) <= 1:
+            return
+
+        classes = [self.priority(*self.classify(frame)) for frame in frames]
+        name = min(classes, key=self.CLASSES.index)
+        pending = self.pending[name]
+
+        pending.append([None, "burst", list(frames), time.monotonic()])
+        self.enqueued += len(frames)
+        self.unfinished += len(frames)
+        self.finished.clear()
+        self.not_empty.set()
+
+        metrics = self.metrics[name]
+        metrics["enqueued"] += len(frames)
+        metrics["max_depth"] = max(metrics["max_depth"], self.size(pending))
+
+    def clear(self):
+        # Drops everything pending - frames of a connection that is gone, encoded for its session
+        for name, pending in self.pending.items():
+            self.metrics[name]["dropped"] += self.size(pending)
+            for i in range(self.size(pending)):
+                self.task_done()
+            pending.clear()
+
+        self.not_empty.clear()
+
+    async def put(self, frame):
+        self.put_nowait(frame)
+
+    async def get(self):
+        while self.empty():
+            self.not_empty.clear()
+            await self.not_empty.wait()
+
+        for name in self.CLASSES:
+            pending = self.pending[name]
+            if pending:
+                entry = pending[0]
+                if entry[1] == "burst":
+                    # The rest of the burst stays at the head of its class
+                    frame, queued = entry[2].pop(0), entry[3]
+                    if not entry[2]:
+                        pending.popleft()
+                else:
+                    cmd, kind, frame, queued = pending.popleft()
+                break
+
+        wait = time.monotonic() - queued
+        metrics = self.metrics[name]
+        metrics["sent"] += 1
+        metrics["wait_total"] += wait
+        metrics["wait_max"] = max(metrics["wait_max"], wait)
+
+        if self.empty():
+            self.not_empty.clear()
+
+        return frame
+
+    def task_done(self):
+        if self.unfinished <= 0:
+            raise ValueError("task_done() called too many times")
+
+        self.unfinished -= 1
+        if self.unfinished == 0:
+            self.finished.set()
+
+    async def join(self):
+        await self.finished.wait()
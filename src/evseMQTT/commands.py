@@ -1,162 +1,220 @@
+import asyncio
+import contextlib
 import json
 from .utils import Utils
+from .schema import Schema
+from .command_encoder import CommandEncoder
+from .response_tracker import ResponseTracker
 
 class Commands:
+    # Payloads that never change - hashable, so the frames carrying them can be prebuilt
+    CONFIRM = bytes(Schema.ACTION.pack(1))
+    QUERY = bytes(Schema.QUERY.pack(2, 0))
+    FEE = bytes(Schema.pack(33028, 1, 1, 0))
+    LCD_BRIGHTNESS_QUERY = bytes(Schema.pack(33122, 0, 1, 0, 1))
+
+    # Seconds to wait for the response, and how often the command is sent again before giving up.
+    # Commands not listed here aren't answered by the charger, or the answer can't be told apart - e.g. the charge
+    # status record (32781) is answered with 13, the same as the periodic status.
+    RESPONSES = {
+        32770: (5, 2),  # login_request -> 2
+        32775: (5, 1),  # charge_start -> 7
+        32776: (3, 3),  # charge_stop -> 8, it has to get through
+        33025: (3, 2),  # time -> 257
+        33030: (3, 2),  # version -> 262
+        33031: (3, 2),  # output amps -> 263
+        33032: (3, 2),  # name -> 264
+        33039: (3, 2),  # language -> 271
+        33042: (3, 2),  # temperature unit -> 274
+    }
+
     def __init__(self, ble_manager, device, logger):
         self.ble_manager = ble_manager
         self.device = device
         self.logger = logger  # Use the centralized logger
+        self._encoder = None
+        self.collecting = None
+        self.responses = ResponseTracker(logger, self.resend)
+
+    @property
+    def encoder(self):
+        # Built once per session - rebuilt if the device reports a different serial or the password changes
+        serial = self.device.info['serial']
+        if self._encoder is None or self._encoder.serial != serial or self._encoder.password != self.device.ble_password:
+            self._encoder = CommandEncoder(serial, self.device.ble_password)
+        return self._encoder
+
+    def reset(self):
+        self._encoder = None
+        self.responses.cancel()
+
+    async def send(self, command):
+        # Queues the command and returns a future for the charger's response - resolved with the parsed response,
+        # or None right away for commands that aren't answered. Don't wait on it while handling a notification,
+        # the response can't be processed until that handler returns.
+        cmd = (command[19] << 8) | command[20]
+
+        if cmd in self.RESPONSES:
+            response = self.responses.expect(cmd, command, *self.RESPONSES[cmd])
+        else:
+            response = asyncio.get_running_loop().create_future()
+            response.set_result(None)
+
+        # Inside burst() commands are collected, and queued together when the burst ends
+        if self.collecting is not None:
+            self.collecting.append(command)
+        else:
+            await self.ble_manager.message_producer(command)
+
+        return response
+
+    async def resend(self, command):
+        # Retries skip any burst being collected
+        await self.ble_manager.message_producer(command)
+
+    @contextlib.asynccontextmanager
+    async def burst(self):
+        # Queues every command issued in the block as one burst - sent in the order issued, even when the commands
+        # belong to different priority classes.
+        # If the block fails, nothing is queued - and nothing of it is sent again by the response tracker
+        self.collecting = []
+        try:
+            yield
+            await self.ble_manager.message_burst(self.collecting)
+        except BaseException:
+            for command in self.collecting:
+                self.responses.withdraw(command)
+            raise
+        finally:
+            self.collecting = None
 
     async def login_request(self):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 32770)
+        command = self.encoder.static(32770)
         self.logger.debug(f"Generated command for: 32770 - login_request\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
 
     async def login_confirm(self):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 32769, [1])
+        command = self.encoder.static(32769, self.CONFIRM)
         self.logger.debug(f"Generated command for: 32769 - login_confirm\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
         
     async def heartbeat(self):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 32771, [1])
+        command = self.encoder.static(32771, self.CONFIRM)
         self.logger.debug(f"Generated command for: 32771 - heartbeat\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
 
     async def set_charge_fee(self):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 33028, [1, 1, 0, 0])
+        command = self.encoder.static(33028, self.FEE)
         self.logger.debug(f"Generated command for: 33028 - set_charge_fee\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
 
     async def get_charge_fee(self):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 33028, [2, 0])
+        command = self.encoder.static(33028, self.QUERY)
         self.logger.debug(f"Generated command for: 33028 - get_charge_fee\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
         
     async def set_charge_service_fee(self):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 33029, [1, 1, 0, 0])
+        command = self.encoder.static(33029, self.FEE)
         self.logger.debug(f"Generated command for: 33029 - set_charge_service_fee\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
         
     async def get_charge_service_fee(self):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 33029, [2, 0])
+        command = self.encoder.static(33029, self.QUERY)
         self.logger.debug(f"Generated command for: 33029 - get_charge_service_fee\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
         
     async def get_charge_status_record(self):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 32781)
+        command = self.encoder.static(32781)
         self.logger.debug(f"Generated command for: 32781 - get_charge_status_record\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
         
     async def set_charge_start(self, max_amps = 6):
         # if there's multiple phases, the line_id is 2 - otherwise 1
         line_id = 2 if self.device.info['phases'] == 3 else 1
-        user_id = self.device.ble_user_id
-        charge_id = Utils.generate_charge_id()
+        user_id = bytes(self.device.ble_user_id)
+        charge_id = bytes(Utils.generate_charge_id())
         is_reservation = 0
-        start_date = Utils.timestamp_bytes()
+        start_date = Utils.meanwhile_in_shanghai()
         start_type = 1
         charge_type = 1
-        param1 = [255, 255]
-        param2 = [255, 255]
-        param3 = [255, 255]
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 32775, [line_id, user_id, charge_id, is_reservation, start_date, start_type, charge_type, param1, param2, param3, max_amps])
+        param1 = 65535
+        param2 = 65535
+        param3 = 65535
+        command = self.encoder.encode(32775, Schema.pack(32775, line_id, user_id, charge_id, is_reservation, start_date, start_type, charge_type, param1, param2, param3, max_amps))
         self.logger.debug(f"Generated command for: 32775 - set_charge_start\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
     
     async def set_charge_stop(self):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 32776, [1, self.device.ble_user_id, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
+        command = self.encoder.encode(32776, Schema.pack(32776, 1, bytes(self.device.ble_user_id)))
         self.logger.debug(f"Generated command for: 32776 - set_charge_stop\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
         
     async def get_config_version(self):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 33030)
+        command = self.encoder.static(33030)
         self.logger.debug(f"Generated command for: 33030 - get_config_version\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
         
     async def set_config_temperature_unit(self, unit):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 33042, [1, unit])
+        command = self.encoder.encode(33042, Schema.pack(33042, 1, unit))
         self.logger.debug(f"Generated command for: 33042 - set_config_temperature_unit\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
         
     async def get_config_temperature_unit(self):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 33042, [2, 0])
+        command = self.encoder.static(33042, self.QUERY)
         self.logger.debug(f"Generated command for: 33042 - get_config_temperature_unit\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
         
     async def set_config_language(self, language):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 33039, [1, language])
+        command = self.encoder.encode(33039, Schema.pack(33039, 1, language))
         self.logger.debug(f"Generated command for: 33039 - set_config_language\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
         
     async def get_config_language(self):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 33039, [2, 0])
+        command = self.encoder.static(33039, self.QUERY)
         self.logger.debug(f"Generated command for: 33039 - get_config_language\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
         
     async def set_config_name(self, name):
-        bytes = Utils.device_name(name)
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 33032, [1, bytes])
+        name_bytes = bytes(Utils.device_name(name))
+        command = self.encoder.encode(33032, Schema.pack(33032, 1, name_bytes))
         self.logger.debug(f"Generated command for: 33032 - set_config_name\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
         
     async def get_config_name(self):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 33032, [2, 0])
+        command = self.encoder.static(33032, self.QUERY)
         self.logger.debug(f"Generated command for: 33032 - get_config_name\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
         
     async def set_config_time(self):
-        timestamp = Utils.timestamp_bytes()
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 33025, [1, timestamp])
+        timestamp = Utils.meanwhile_in_shanghai()
+        command = self.encoder.encode(33025, Schema.pack(33025, 1, timestamp))
         self.logger.debug(f"Generated command for: 33025 - set_config_time\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
         
     async def get_config_time(self):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 33025, [2, 0])
+        command = self.encoder.static(33025, self.QUERY)
         self.logger.debug(f"Generated command for: 33025 - get_config_time\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
     
     async def set_config_output_amps(self, max_amps = 6):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 33031, [1, max_amps])
+        command = self.encoder.encode(33031, Schema.pack(33031, 1, max_amps))
         self.logger.debug(f"Generated command for: 33031 - set_config_output_amps\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
     
     async def get_config_output_amps(self):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 33031, [2, 0])
+        command = self.encoder.static(33031, self.QUERY)
         self.logger.debug(f"Generated command for: 33031 - get_config_output_amps\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
     
     async def set_config_lcd_brightness(self, brightness = 100):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 33122, [0, 2, brightness, 0, 0, 0, 0, 0])
+        command = self.encoder.encode(33122, Schema.pack(33122, 0, 2, brightness, 0))
         self.logger.debug(f"Generated command for: 33122 - set_config_lcd_brightness\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
     
     async def get_config_lcd_brightness(self):
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 33122, [0, 1, 0, 1, 0, 0, 0, 0])
+        command = self.encoder.static(33122, self.LCD_BRIGHTNESS_QUERY)
         self.logger.debug(f"Generated command for: 33122 - get_config_lcd_brightness\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
+        return await self.send(command)
     
     async def set_config_password(self, password):
         if len(password) != 6:
@@ -166,10 +224,6 @@ class Commands:
         # Convert the integer to a string to process each digit 
         str_password = str(password)
         
-        # Convert each digit to its ASCII integer representation 
-        password_integers = [ord(char) for char in str_password]
-        
-        command = Utils.build_command(self.device.info['serial'], self.device.ble_password, 33026, password_integers)
+        command = self.encoder.encode(33026, Schema.pack(33026, str_password.encode('ascii')))
         self.logger.debug(f"Generated command for: 33026 - set_config_password\n{command}")
-        await self.ble_manager.message_producer(command)
-        return command.hex()
\ No newline at end of file
+        return await self.send(command)
\ No newline at end of file
@@ -15,6 +15,29 @@ class Constants:
     NEW_BOARD_READ_UUID = "0000ffe4-0000-1000-8000-00805f9b34fb"
 
 
+    # Minimum change before a value is considered changed, when only publishing changes
+    PUBLISH_DEADBANDS = {
+        "l1_voltage": 0.5,
+        "l2_voltage": 0.5,
+        "l3_voltage": 0.5,
+        "inner_temp_c": 0.2,
+        "inner_temp_f": 0.36,
+        "outer_temp": 0.2,
+    }
+
+    # Same, as a fraction of the last published value - the charging power is computed from voltage and current,
+    # so it changes with every bit of voltage jitter, and is in W or kW depending on the unit
+    PUBLISH_RELATIVE_DEADBANDS = {
+        "current_energy": 0.01,
+    }
+
+    # Changes to these fields are published right away, bypassing the coalescing window
+    PUBLISH_PRIORITY_FIELDS = ("charger_status", "error_details")
+
+    # State fields that rarely change - their JSON is encoded once and reused. Splitting a payload only pays off
+    # when a good part of it is static, so fields of the per-second charge state are deliberately left out
+    STATIC_STATE_FIELDS = ("version", "device_name", "language", "temperature_unit")
+
     ERRORS = {
         0: "Relay Stick Error",
         1: "Relay Stick Error",
@@ -0,0 +1,42 @@
+class DeviceCache:
+    # What a charger reported the last time, per MAC address: its board revision (the characteristic UUIDs),
+    # identity and configuration. Restored on connect, so discovery and state can be published before the login
+    # handshake finished - the handshake then confirms or updates it.
+
+    INFO = (
+        'serial', 'type', 'phases', 'manufacturer', 'model', 'hardware_version', 'software_version',
+        'output_power', 'output_max_amps', 'feature', 'support', 'mac',
+    )
+    CONFIG = ('charge_amps', 'lcd_brightness', 'temperature_unit', 'language', 'device_name')
+
+    def __init__(self, state_store):
+        self.state_store = state_store
+
+    def name(self, address):
+        return f"device_{address.replace(':', '').lower()}"
+
+    def load(self, address):
+        profile = self.state_store.load(self.name(address))
+
+        # Only usable if the charger got as far as reporting its serial and software version
+        if not profile or not profile.get("info", {}).get("serial") or not profile["info"].get("software_version"):
+            return None
+
+        return profile
+
+    def save(self, address, device, write_uuid, read_uuid):
+        self.state_store.save(self.name(address), {
+            "write_uuid": write_uuid,
+            "read_uuid": read_uuid,
+            "fallback": device.fallback,
+            "info": {field: device.info[field] for field in self.INFO},
+            "config": {field: device.config[field] for field in self.CONFIG if device.config[field] is not None},
+        })
+
+    def identity(self, info):
+        return {field: info.get(field) for field in self.INFO}
+
+    def restore(self, profile, device):
+        device.fallback = profile.get("fallback", False)
+        device.info = self.identity(profile["info"])
+        device.config = profile.get("config", {})
@@ -1,16 +1,29 @@
 from .parsers import Parsers
 from .utils import Utils
 from .constants import Constants
+from .frame_decoder import FrameDecoder
+from .frame import Frame
 import asyncio
+import time
 
 class EventHandlers:
+    # Handshake stages, in the order they are normally reached after connecting
+    STAGES = ("beacon", "logged_in", "version", "first_status", "configured", "discovery")
+
     def __init__(self, device, commands, logger, callback=None):
         self.logger = logger  # Use the centralized logger
         self.device = device
         self.commands = commands
         self.callback = callback
-        self.cache_data = None
-        self.message_length = 0
+        self.decoder = FrameDecoder(logger=logger)
+        self.lock = asyncio.Lock()
+        self.serials = {}  # Raw serial bytes -> interned serial string, per connection
+        self.initial_reads = None
+
+        # One event per handshake stage, set once per connection, and the seconds from connecting to each stage
+        self.stages = {stage: asyncio.Event() for stage in self.STAGES}
+        self.timings = {}
+        self.connected_at = None
 
         # Registry of command values to handler methods
         self.handlers = {
@@ -44,98 +57,77 @@ class EventHandlers:
             274: "config",        
         }
         
-    async def receive_notification(self, sender, byte_array):
-        self.logger.debug(f"Notification from {sender}: {byte_array}")
-
-        packet_header = Constants.PACKET_HEADER
-        if Utils.byte_to_string(byte_array[:2] if len(byte_array) >= 2 else byte_array[:1]) == packet_header:
-            self.logger.debug(f"Packet Header OK")
-            self.cache_data = byte_array
-            if len(byte_array) >= 4:
-                self.message_length = ((byte_array[2] << 8) + byte_array[3]) & 255
-                if self.message_length > len(byte_array):
-                    return
-                await self.process_notification(sender, byte_array)
-                return
-            
-            self.message_length = 0
-            return
-
-        if self.cache_data is None:
-            self.logger.debug(f"No cache_data found")
+    def reset(self):
+        # Drop any partial frame and cached serial left over from a stale connection
+        self.decoder.reset()
+        self.serials.clear()
+        
+        for event in self.stages.values():
+            event.clear()
+
+    def connected(self):
+        # Called by the BLE manager before notifications start - the handshake timings count from here
+        self.reset()
+        self.timings = {}
+        self.connected_at = time.monotonic()
+
+    def reached(self, stage):
+        event = self.stages[stage]
+        if event.is_set():
             return
+        
+        event.set()
+        if self.connected_at is not None:
+            self.timings[stage] = round(time.monotonic() - self.connected_at, 3)
+            self.logger.info(f"Handshake: {stage} after {self.timings[stage]:.2f}s")
+
+    async def wait_for(self, stage):
+        await self.stages[stage].wait()
+
+    async def wait_initial_reads(self, responses):
+        started = asyncio.get_running_loop().time()
+        results = await asyncio.gather(*responses, return_exceptions=True)
+        failed = sum(1 for result in results if isinstance(result, BaseException))
+        
+        if failed:
+            self.logger.warning(f"{failed} of {len(results)} initial configuration reads went unanswered")
+        else:
+            self.logger.info(f"Initial configuration read in {asyncio.get_running_loop().time() - started:.2f}s")
+        
+        self.reached("configured")
 
-        if self.message_length == 0:
-            self.message_length = len(self.cache_data) + len(byte_array)
+    def forward(self, topic):
+        # Hands the device state of topic to the callback, once the device has been correctly initialized
+        if self.callback and self.device.initialization_state:
+            self.callback(self.device.info['serial'], topic, getattr(self.device, topic))
 
-        try:
-            combined_data = self.cache_data + byte_array
-            if self.message_length > len(combined_data):
-                self.cache_data = combined_data
-                return
+    async def receive_notification(self, sender, byte_array):
+        self.logger.debug(f"Notification from {sender}: {byte_array}")
 
-            await self.process_notification(sender, combined_data)
-            self.cache_data = None
-            self.message_length = 0
-        except Exception as e:
-            self.logger.error(f"Exception occurred: {e}")
+        # Notifications are dispatched as separate tasks by bleak - handle them one at a time,
+        # so frames are processed in the order they arrived
+        async with self.lock:
+            for frame in self.decoder.feed(byte_array):
+                try:
+                    await self.process_notification(sender, frame)
+                except Exception as e:
+                    self.logger.error(f"Exception occurred: {e}")
 
     async def process_notification(self, sender, byte_array):
-        if len(byte_array) >= 25 and Utils.byte_to_string(byte_array[:2]) == Constants.PACKET_HEADER:
-            length = ((byte_array[2] << 8) + byte_array[3]) & 255
-            reserved_byte = byte_array[4]
-            serial = Utils.byte_to_string(Utils.get_bytes(byte_array, 5, 12))
-
-            self.logger.debug(f"Data length: {length}, Key type: {reserved_byte}, Serial number: {serial}")
-            byte_array2 = bytearray(1)
+        frame = Frame(byte_array, self.serials)
 
-            if reserved_byte == 0:
-                cmd_byte = Utils.byte_to_string(Utils.get_bytes(byte_array, 19, 20))
-                cmd = int(cmd_byte, 16)
-                if cmd != 3:
-                    byte_array2 = Utils.get_bytes(byte_array, 21, length - 5)
-                    self.cache_data = None
+        self.logger.debug(f"Data length: {len(frame)}, Key type: {frame.reserved}, CMD[0x{frame.cmd:04X}]")
+        await self.handle_notification(sender, frame)
 
-            if byte_array2 is None:
-                self.logger.debug(f"Data error: {Utils.byte_to_string(byte_array)}")
-                return
-
-            crc_length = length - 4
-            bytes_val = Utils.get_bytes(byte_array, crc_length, length - 3)
-            checksum = (bytes_val[0] << 8) + (bytes_val[1] & 0xFF)
-            checksum_calc = sum(byte_array[i] & 0xFF for i in range(crc_length))
-
-            if checksum_calc % 65536 != checksum:
-                self.logger.debug("Checksum failed")
-                return
-
-            self.logger.debug("Checksum OK")
-
-            self.logger.debug(f"Unencrypted data length: {len(byte_array2)}, CMD[0x{cmd_byte}]")
-            await self.handle_notification(sender, byte_array)
-
-            if len(byte_array) > length:
-                await self.process_notification(sender, Utils.get_bytes(byte_array, length, len(byte_array) - 1))
-                
-    async def handle_notification(self, sender, message):
-        # Split the byte array on \x06\x01 and validate following bytes (serial)
-        #segments = Utils.split_message(message)
-        #self.logger.debug(f"Segments: {segments}")
-        
-        #for segment in segments:
-        #    if segment:
-        #parsed_data = Utils.parse_bytearray(segment)
-        parsed_data = Utils.parse_bytearray(message)
-        cmd = parsed_data['cmd']
+    async def handle_notification(self, sender, frame):
+        cmd = frame.cmd
         self.logger.debug(f"Received command {cmd}")
         
-        self.logger.debug(f"Parsed data:\n{parsed_data}")
-        
         data = None
         
         if cmd in self.handlers:
             handler = self.handlers[cmd]
-            data = handler(parsed_data['data'], parsed_data['identifier'])
+            data = handler(frame)
             self.logger.debug(f"Parsed data\n{data}")
             # Update device info if command 1 is received
             if cmd == 1:
@@ -153,6 +145,7 @@ class EventHandlers:
                     data['current_energy'] = data['current_energy'] / 1000
                 
                 self.device.charge = data
+                self.reached("first_status")
                 
             # Device charge status -- not sure what we need these for
             if cmd in [5, 6]:
@@ -173,6 +166,10 @@ class EventHandlers:
             if cmd == 262:
                 self.logger.debug(f"Device responded with {cmd}, containing {data}")
                 self.device.info = data
+                
+                if self.device.info['software_version'] is not None:
+                    self.reached("version")
+            
             # Update device config if command is related
             if cmd in [257, 263, 264, 271, 274]:
                 self.logger.debug(f"Device responded with {cmd}, containing {data}")
@@ -182,41 +179,54 @@ class EventHandlers:
             if cmd == 341:
                 self.logger.error(f"Password was not accepted by device!")
         
+        if cmd == 1 and self.device.initialization_state:
+            self.reached("beacon")
+        
         if cmd == 1 and self.device.initialization_state and not self.device.logged_in:
             self.logger.info(f"Device sent login banner - requesting login")
             await self.commands.login_request()
             await self.commands.set_charge_fee()
             await self.commands.set_charge_service_fee()
             
-        if cmd == 2 and self.device.info['software_version'] is None and not self.device.logged_in:
+        # The software version may already be known from the device cache - logged_in tells if this is a new login
+        if cmd == 2 and not self.device.logged_in:
             self.logger.info(f"Device sent response to login request - confirming login")
             
             await self.commands.login_confirm()
             
             self.device.logged_in = True
+            self.reached("logged_in")
             
-            await self.commands.get_config_temperature_unit()
-            await self.commands.get_config_version()
-            await self.commands.get_config_name()
-            await self.commands.get_config_output_amps()
-            await self.commands.get_config_language()
-            await self.commands.get_config_lcd_brightness()
-            await self.commands.set_config_time()
-            await self.commands.get_charge_status_record()
-            await asyncio.sleep(2)  # Ugly hack - but hey ... it works
+            # The other revision doesn't report a software version - use the hardware version
+            if self.device.fallback:
+                self.logger.info(f"Fallback: software_version populated with hardware_version.")
+                self.device.info = {'software_version': self.device.info['hardware_version']}
+                self.reached("version")
+            
+            # Only queued here - the responses are handled by this same handler once it returns, so they are
+            # awaited in a separate task
+            responses = [
+                await self.commands.get_config_temperature_unit(),
+                await self.commands.get_config_version(),
+                await self.commands.get_config_name(),
+                await self.commands.get_config_output_amps(),
+                await self.commands.get_config_language(),
+                await self.commands.get_config_lcd_brightness(),
+                await self.commands.set_config_time(),
+                await self.commands.get_charge_status_record(),
+            ]
+            self.initial_reads = asyncio.create_task(self.wait_initial_reads(responses))
         
         if cmd == 3 and self.device.initialization_state:
             self.logger.info(f"Device sent heartbeat - replying")
             await self.commands.heartbeat()
             await self.commands.set_config_time()
         
-        # Before we forward the message, we check if:
-        #   - the callback exists
-        #   - the cmd is in forwarded messages
-        #   - data is not None
-        #   - device has been correctly initialized
-        if self.callback and cmd in self.forward_messages and data is not None and self.device.initialization_state:
-            topic = self.forward_messages[cmd]
-            self.callback(self.device.info['serial'], topic, getattr(self.device, topic))
+        # Forward the message if the cmd is in forwarded messages and data is not None
+        if cmd in self.forward_messages and data is not None:
+            self.forward(self.forward_messages[cmd])
+        
+        # Resolve the commands waiting for this response, once the device is updated
+        self.commands.responses.resolve(cmd, data)
                     
         return cmd
\ No newline at end of file
@@ -0,0 +1,51 @@
+import sys
+
+class Frame:
+    # Thin view over a single decoded frame - fields are only decoded when they are accessed
+    __slots__ = ('view', 'serials')
+
+    def __init__(self, view, serials=None):
+        self.view = view
+        self.serials = serials if serials is not None else {}
+
+    def __len__(self):
+        return len(self.view)
+
+    @property
+    def length(self):
+        return (self.view[2] << 8) | self.view[3]
+
+    @property
+    def reserved(self):
+        return self.view[4]
+
+    @property
+    def identifier(self):
+        # The serial is hex encoded once per connection, every following frame is a dictionary lookup
+        raw = self.view[5:13].tobytes()
+        identifier = self.serials.get(raw)
+
+        if identifier is None:
+            identifier = sys.intern(raw.hex().upper())
+            self.serials[raw] = identifier
+
+        return identifier
+
+    @property
+    def password(self):
+        return self.view[13:19].tobytes()
+
+    @property
+    def cmd(self):
+        return (self.view[19] << 8) | self.view[20]
+
+    @property
+    def data(self):
+        return self.view[21:-4]
+
+    @property
+    def checksum(self):
+        return (self.view[-4] << 8) | self.view[-3]
+
+    def __repr__(self):
+        return f"<Frame cmd={self.cmd} length={len(self.view)} data={self.data.hex()}>"
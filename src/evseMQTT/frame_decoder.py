@@ -0,0 +1,107 @@
+class FrameDecoder:
+    HEADER = b'\x06\x01'
+    MIN_LENGTH = 25  # header(2) + length(2) + reserved(1) + serial(8) + password(6) + cmd(2) + checksum(2) + end(2)
+
+    def __init__(self, logger=None, capacity=4096):
+        self.logger = logger
+        self.capacity = capacity
+
+        # Preallocated buffer - notifications are copied in once and frames are handed out as memoryview slices
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._read = 0
+        self._write = 0
+
+        # Counters, mostly useful for debugging flaky links
+        self.frames = 0
+        self.resyncs = 0
+        self.checksum_errors = 0
+
+    def reset(self):
+        self._read = 0
+        self._write = 0
+
+    def pending(self):
+        return self._write - self._read
+
+    def feed(self, data):
+        # Yields every complete frame found in the buffered stream, one at a time.
+        # The yielded memoryview is only valid until the next call to feed()
+        data = memoryview(data)
+        offset = 0
+
+        while offset < len(data):
+            offset += self._append(data[offset:])
+            yield from self._frames()
+
+    def _append(self, data):
+        # Move the unread tail to the front when there is no room left at the end
+        if self._write + len(data) > self.capacity and self._read > 0:
+            pending = self._write - self._read
+            self._view[:pending] = self._view[self._read:self._write]
+            self._read = 0
+            self._write = pending
+
+        count = min(len(data), self.capacity - self._write)
+        self._view[self._write:self._write + count] = data[:count]
+        self._write += count
+        return count
+
+    def _frames(self):
+        while self._write - self._read >= 4:
+            read = self._read
+
+            if self._buffer[read] != 6 or self._buffer[read + 1] != 1:
+                self._resync(read + 1)
+                continue
+
+            length = (self._buffer[read + 2] << 8) | self._buffer[read + 3]
+
+            if length < self.MIN_LENGTH or length > self.capacity:
+                if self.logger:
+                    self.logger.debug(f"Invalid frame length {length} - resyncing")
+                self._resync(read + 1)
+                continue
+
+            if self._write - read < length:
+                # Wait for the rest of the frame
+                return
+
+            frame = self._view[read:read + length]
+            crc_length = length - 4
+            checksum = (frame[crc_length] << 8) | frame[crc_length + 1]
+
+            if sum(frame[:crc_length]) % 65536 != checksum:
+                if self.logger:
+                    self.logger.debug("Checksum failed")
+                self.checksum_errors += 1
+                self._resync(read + 1)
+                continue
+
+            self._read = read + length
+            self.frames += 1
+            yield frame
+
+        # Keep a trailing header byte around, drop anything else that can't start a frame
+        if self._write - self._read in (1, 2, 3) and self._buffer[self._read] != 6:
+            self._resync(self._read + 1)
+
+        # Rewind once everything has been consumed, so the common case never has to compact
+        if self._read == self._write:
+            self._read = 0
+            self._write = 0
+
+    def _resync(self, start):
+        # Skip to the next possible header - everything before it is garbage
+        index = self._buffer.find(self.HEADER, start, self._write)
+
+        if index == -1:
+            # A lone 0x06 at the end might be the first half of the next header
+            index = self._write - 1 if self._write > start and self._buffer[self._write - 1] == 6 else self._write
+
+        self.resyncs += 1
+        self._read = index
+
+        if self._read == self._write:
+            self._read = 0
+            self._write = 0
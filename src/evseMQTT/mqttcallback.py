@@ -1,56 +1,208 @@
+import asyncio
 import json
+import time
 from .constants import Constants
 
 class MQTTCallback:
-    def __init__(self, device=None, commands=None):
+    def __init__(self, device=None, commands=None, command_expiry=None, ready=None, mqtt_client=None):
         self.device = device
         self.commands = commands
+        self.mqtt_client = mqtt_client  # Acknowledgements go through its spool and flow control
+        self.ready = ready  # Event set once the charger is logged in
         self.logger = self.commands.logger # Hacky - but ... does it work? Passing logger to the class, will create duplicate log lines
+        
+        # Seconds a command stays valid when the publisher didn't set an MQTT v5 message expiry, None or 0 never expires
+        self.command_expiry = command_expiry
+        self.expired = 0
+        
+        # Acknowledgements waiting for the charger's responses
+        self.acknowledging = set()
+    
+    def deadline(self, message):
+        # paho stamps received messages with time.monotonic()
+        properties = getattr(message, "properties", None)
+        expiry = getattr(properties, "MessageExpiryInterval", None) if properties else None
+        
+        if expiry is None:
+            expiry = self.command_expiry
+        
+        return message.timestamp + expiry if expiry else None
+    
+    async def wait_until_ready(self, deadline):
+        # Commands arriving while the charger is out of reach wait for the login, but not past their expiry
+        if self.ready is None:
+            while not self.device.logged_in:
+                if time.monotonic() >= deadline:
+                    return False
+                await asyncio.sleep(0.25)
+        elif not self.ready.is_set():
+            try:
+                await asyncio.wait_for(self.ready.wait(), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                return False
+        
+        return time.monotonic() < deadline
+    
+    def operations(self, payload):
+        # A command is an object - one or several keys, applied in order - or a list of such objects.
+        # "id" is not an operation, it is echoed in the acknowledgement
+        if isinstance(payload, dict):
+            payload = [payload]
+        
+        if not isinstance(payload, list) or not all(isinstance(element, dict) for element in payload):
+            raise ValueError("Expected an object or a list of objects")
+        
+        # Home Assistant number entities may send whole numbers as floats
+        return [
+            (key, int(value) if isinstance(value, float) and value.is_integer() else value)
+            for element in payload for key, value in element.items() if key != "id"
+        ]
+    
+    def validate(self, key, value, earlier=()):
+        # Everything is checked before anything is sent, so a batch is applied completely or not at all.
+        # earlier are the keys of the operations before this one in the batch
+        if key == "charge_state":
+            if value not in (0, 1, True, False):
+                return "expected 0 or 1"
+            # Charging starts with the configured amps - unknown until the charger reported them
+            if value and self.device.config['charge_amps'] is None and "charge_amps" not in earlier:
+                return "charge amps not known yet, set charge_amps too"
+            return None
+        
+        if key == "charge_amps":
+            maximum = self.device.info['output_max_amps'] or 32
+            return None if type(value) is int and 6 <= value <= maximum else f"expected 6 to {maximum}"
+        
+        if key == "lcd_brightness":
+            return None if type(value) is int and 1 <= value <= 100 else "expected 1 to 100"
+        
+        if key == "temperature_unit":
+            return None if value in Constants.TEMPERATURE_UNIT else f"expected one of {', '.join(Constants.TEMPERATURE_UNIT)}"
+        
+        if key == "language":
+            return None if value in Constants.LANGUAGES else f"expected one of {', '.join(Constants.LANGUAGES)}"
+        
+        if key == "device_name":
+            return None if isinstance(value, str) and 1 <= len(value) <= 11 else "expected 1 to 11 characters"
+        
+        return "unknown command"
+    
+    def acknowledge(self, client, message, ack):
+        # One acknowledgement per command message, however many operations it held
+        publish = self.mqtt_client.publish if self.mqtt_client else client.publish
+        publish(f"{message.topic}/ack", json.dumps(ack), 0, False)
     
     async def delegate(self, client, userdata, message):
+        ack = {"ok": False}
+        
         # Decode and convert the JSON string to a dictionary
-        payload = json.loads(message.payload.decode("utf-8"))
+        try:
+            payload = json.loads(message.payload.decode("utf-8"))
+            operations = self.operations(payload)
+        except ValueError as e:
+            self.logger.warning(f"Ignoring malformed command {message.payload}: {e}")
+            self.acknowledge(client, message, {"ok": False, "error": f"malformed command: {e}"})
+            return
+        
+        if isinstance(payload, dict) and "id" in payload:
+            ack["id"] = payload["id"]
+        
+        errors = {key: error for index, (key, value) in enumerate(operations) if (error := self.validate(key, value, [key for key, value in operations[:index]]))}
+        if errors or not operations:
+            self.logger.warning(f"Rejecting command {message.payload}: {errors or 'no operations'}")
+            self.acknowledge(client, message, dict(ack, errors=errors or {"": "no operations"}))
+            return
+        
+        # Drop commands that expired before they could reach the charger - replaying an old charge_state toggle
+        # after a reconnect would do more harm than good
+        deadline = self.deadline(message)
+        if deadline is not None and not await self.wait_until_ready(deadline):
+            self.expired += 1
+            self.logger.warning(f"Dropping expired command: {message.payload}")
+            self.acknowledge(client, message, dict(ack, error="expired"))
+            return
         
-        # Get the key of the payload
-        key = next(iter(payload))
-                
-        # Retrieve the function from functions, based on the key retrieved
-        value = payload[key]
+        # Queued as one burst, in the order given
+        responses = []
+        try:
+            async with self.commands.burst():
+                for key, value in operations:
+                    responses.append(await self.apply(key, value))
+        except Exception as e:
+            # Nothing of the burst was queued
+            self.logger.error(f"Applying command {message.payload} failed: {e}")
+            self.acknowledge(client, message, dict(ack, error=f"failed: {e}"))
+            return
         
+        # Acknowledged once the charger answered - meanwhile the next command can be queued, and coalesced with
+        # this one while it wasn't sent yet
+        task = asyncio.create_task(self.acknowledge_responses(client, message, ack, operations, responses))
+        self.acknowledging.add(task)
+        task.add_done_callback(self.acknowledging.discard)
+    
+    async def acknowledge_responses(self, client, message, ack, operations, responses):
+        # The responses carry the new values and update device.config - no need to read the settings back
+        results = await asyncio.gather(*responses, return_exceptions=True)
+        errors = {}
+        applied = []
+        for (key, value), result in zip(operations, results):
+            if isinstance(result, BaseException):
+                # A frame that couldn't be written says so, anything else went unanswered
+                error = str(result) if isinstance(result, ConnectionError) else "no response from the charger"
+            else:
+                error = self.refused(key, result)
+            if error:
+                errors[key] = error
+            else:
+                applied.append(key)
+        
+        if errors:
+            self.acknowledge(client, message, dict(ack, errors=errors, applied=applied))
+        else:
+            self.acknowledge(client, message, dict(ack, ok=True, applied=applied))
+    
+    def refused(self, key, result):
+        # Charge start and stop are answered when they failed too - the response says why
+        if key != "charge_state" or not isinstance(result, dict):
+            return None
+        
+        # Starting while already charging leaves the charger where it was asked to be
+        reason = result.get("error_reason")
+        if reason in (None, 0, "No error", "Charging"):
+            return None
+        
+        return f"refused by the charger: {reason}"
+    
+    async def apply(self, key, value):
+        # Queues the command for one operation, returns the future for its response
         if key == "charge_state" and value:
             amps = int(self.device.config['charge_amps'])
             self.logger.info(f"Starting charge with amps to {amps}.")
-            await self.commands.set_charge_start(amps)
+            return await self.commands.set_charge_start(amps)
         
         if key == "charge_state" and not value:
             self.logger.info(f"Stopping charge.")
-            await self.commands.set_charge_stop()
+            return await self.commands.set_charge_stop()
             
         if key == "charge_amps":
             self.logger.info(f"Setting charge amps to {value}.")
-            self.device.config = payload
-            await self.commands.set_config_output_amps(value)
-            
-            # Re-issue get_config_output_amps to retrieve the data and put in device.config
-            await self.commands.get_config_output_amps()
+            self.device.config = {"charge_amps": value}
+            return await self.commands.set_config_output_amps(value)
             
         if key == "lcd_brightness":
             self.logger.info(f"Setting LCD brightness to {value}.")
-            await self.commands.set_config_lcd_brightness(value)
+            return await self.commands.set_config_lcd_brightness(value)
             
         if key == "temperature_unit":
             unit = Constants.TEMPERATURE_UNIT[value]
             self.logger.info(f"Setting Temperature Unit to {value} ({unit}).")
-            await self.commands.set_config_temperature_unit(unit)
+            return await self.commands.set_config_temperature_unit(unit)
             
         if key == "language":
             language = Constants.LANGUAGES[value]
             self.logger.info(f"Setting Language to {value} ({language}).")
-            await self.commands.set_config_language(language)
+            return await self.commands.set_config_language(language)
             
         if key == "device_name":
             self.logger.info(f"Setting name to {value}.")
-            await self.commands.set_config_name(value)
-            
-            # Re-issue get_config_name to retrieve the data and put in device.config
-            await self.commands.get_config_name()
\ No newline at end of file
+            return await self.commands.set_config_name(value)
@@ -1,10 +1,15 @@
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 import json
 import asyncio
+import random
+from .serializer import StateSerializer
 
 class MQTTClient:
-    def __init__(self, logger, client_id, broker, port, username=None, password=None, keepalive=60):
-        self.client = mqtt.Client(client_id)
+    def __init__(self, logger, client_id, broker, port, username=None, password=None, keepalive=60, publish_filter=None, serializer=None, max_inflight=20, mqtt_version="3.1.1", spool=None, drain_rate=500):
+        self.v5 = mqtt_version == "5"
+        self.client = mqtt.Client(client_id, protocol=mqtt.MQTTv5 if self.v5 else mqtt.MQTTv311)
         if username and password:
             self.client.username_pw_set(username, password)
         self.broker = broker
@@ -17,50 +22,410 @@ class MQTTClient:
         self.client.on_subscribe = self.on_subscribe
         self.client.on_publish = self.on_publish
         self.connected = False
+        self.publish_filter = publish_filter  # Optional PublishFilter, suppressing unchanged states
+        self.serializer = serializer or StateSerializer()
+
+        # paho is driven by the asyncio event loop instead of its own thread - the socket is watched with
+        # add_reader/add_writer and loop_misc() runs from a task, so every callback runs on the event loop. Only the
+        # socket connect, DNS lookup included, runs in a worker thread - it blocks for up to paho's connect timeout
+        # (see open)
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+        self.loop = None
+        self.misc = None
+        self.closing = False
+        self.dropped = None  # Set when the connection to the broker dropped
+        self.max_reconnect_delay = 30
+        self.reconnect_delay = 0  # Wait before the next reconnect attempt, 0 right after a working connection
+
+        # Publishes not yet handed to the broker: mid -> (future resolved by on_publish, message to spool if lost)
+        self.max_inflight = max_inflight
+        self.inflight = {}
+        self.writable = None
+
+        # Subscriptions waiting for their SUBACK: mid -> future resolved with the granted QoS
+        self.subscribing = {}
+
+        # MQTT v5 topic aliases for the state topics: topic -> alias, valid for the current connection only
+        self.topic_alias_maximum = 0
+        self.topic_aliases = {}
+
+        # Messages published while the broker is unreachable go to the optional Spool, and are sent at up to
+        # drain_rate messages per second once it is back
+        self.spool = spool
+        self.drain_rate = drain_rate
+
+        # Restored on every (re)connect: topic -> qos, identifier -> last availability
+        self.subscriptions = {}
+        self.availability = {}
+        self.connections = 0
+        self.on_reconnect = None  # Optional coroutine function, awaited after a reconnect was recovered
+        self.recovery = None
+
+        # Incoming messages are handed to the message handler in order, one at a time
+        self.inbox = None
+        self.dispatcher = None
+
+    def on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc != 0:
+            # Refused - paho drops the connection, and the loop tries again with backoff
+            self.logger.warning(f"MQTT broker refused the connection: {rc}")
+            return
 
-    def on_connect(self, client, userdata, flags, rc):
         self.logger.info(f"Connected to MQTT broker")
-        
-    def on_disconnect(self, client, userdata, rc):
+
+        # The broker tells how many aliases it accepts - 0 (or MQTT 3.1.1) disables them
+        self.topic_alias_maximum = getattr(properties, "TopicAliasMaximum", 0) if properties else 0
+        self.topic_aliases = {}
+
+        self.connections += 1
+        self.reconnect_delay = 0
+        self.recovery = self.loop.create_task(self.recover())
+
+    def on_disconnect(self, client, userdata, rc, properties=None):
         self.logger.info(f"Disconnected from MQTT broker")
         self.connected = False
-        
+        self.topic_alias_maximum = 0
+        self.dropped.set()
+
+        if self.recovery:
+            self.recovery.cancel()
+
+        # Whatever was not written is gone with the connection - QoS 0 messages go to the spool, paho itself
+        # sends QoS 1 and 2 messages again
+        for future, message in self.inflight.values():
+            if message and self.spool is not None:
+                self.spool.put(*message)
+            if not future.done():
+                future.set_result(False)
+        self.inflight.clear()
+        self.writable.set()
+
+        for future in self.subscribing.values():
+            if not future.done():
+                future.set_result(None)
+        self.subscribing.clear()
+
     def on_message(self, client, userdata, msg):
         self.logger.info(f"Message received: {msg.topic} {msg.payload}")
 
     def set_on_message(self, on_message):
-        self.client.on_message = lambda client, userdata, message: asyncio.run(on_message(client, userdata, message))
+        self.client.on_message = lambda client, userdata, message: self.inbox.put_nowait((on_message, client, userdata, message))
 
-    def on_subscribe(self, client, userdata, mid, granted_qos):
+    def on_subscribe(self, client, userdata, mid, granted_qos, properties=None):
+        # MQTT v5 reports reason codes instead of plain QoS values
+        granted_qos = [getattr(code, "value", code) for code in granted_qos]
         self.logger.info(f"Subscribed with QoS: {granted_qos}")
 
+        future = self.subscribing.pop(mid, None)
+        if future and not future.done():
+            future.set_result(granted_qos)
+
     def on_publish(self, client, userdata, mid):
         self.logger.debug(f"Message published: {mid}")
 
-    def connect(self):
-        self.client.connect(self.broker, self.port, self.keepalive)
-        self.client.loop_start()
+        future, message = self.inflight.pop(mid, (None, None))
+        if future and not future.done():
+            future.set_result(True)
+
+        if len(self.inflight) < self.max_inflight:
+            self.writable.set()
+
+    def on_socket_open(self, client, userdata, sock):
+        self.loop.add_reader(sock, client.loop_read)
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    async def recover(self):
+        # A new session knows nothing of the previous one - restore subscriptions and availability, then send
+        # what was spooled while the broker was away
+        for topic, qos in self.subscriptions.items():
+            self.client.subscribe(topic, qos)
+
+        for identifier, state in self.availability.items():
+            self.publish_availability(identifier, state)
+
+        if self.spool and len(self.spool):
+            messages = self.spool.pop_all()
+            self.logger.info(f"Sending {len(messages)} spooled messages")
+
+            for index, (topic, payload, qos, retain) in enumerate(messages):
+                await self.drain()
+                self.publish(topic, payload, qos, retain)
+
+                if (index + 1) % 50 == 0:
+                    await asyncio.sleep(50 / self.drain_rate)
+
+        if self.connections > 1 and self.on_reconnect:
+            try:
+                await self.on_reconnect()
+            except Exception as e:
+                self.logger.error(f"Restoring state after reconnecting to MQTT broker failed: {e}")
+
+    async def connect(self):
+        self.loop = asyncio.get_running_loop()
+        self.closing = False
+        self.writable = asyncio.Event()
+        self.writable.set()
+        self.dropped = asyncio.Event()
+        self.inbox = asyncio.Queue()
+
+        # An unreachable broker doesn't stop the start - misc_loop keeps trying, and publishes are spooled meanwhile
+        self.client.connect_async(self.broker, self.port, self.keepalive)
+        try:
+            await self.open()
+        except OSError as e:
+            self.logger.warning(f"Connecting to MQTT broker failed: {e}")
+            self.reconnect_delay = 0.5
+
+        self.misc = asyncio.create_task(self.misc_loop())
+        self.dispatcher = asyncio.create_task(self.dispatch_messages())
+
+    async def open(self):
+        # paho's reconnect() opens its socket with a blocking connect. Only that connect runs in a worker thread -
+        # reconnect() itself resets the outgoing packets and queues CONNECT, so it runs on the event loop like every
+        # publish, handed the socket that is already connected
+        sock = await self.loop.run_in_executor(None, self.client._create_socket_connection)
+
+        self.client._create_socket_connection = lambda: sock
+        try:
+            self.client.reconnect()
+        except Exception:
+            sock.close()
+            raise
+        finally:
+            del self.client._create_socket_connection
+
+    async def misc_loop(self):
+        # Keepalive pings and retries, plus reconnecting - what loop_start()'s thread used to do. The first reconnect
+        # attempt follows right after the connection dropped, so a restarted broker is picked up at once. Further
+        # attempts back off from 0.5s to max_reconnect_delay, until the broker accepted a connection again
+        while not self.closing:
+            if self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+                self.dropped.clear()
+                try:
+                    await asyncio.wait_for(self.dropped.wait(), 1)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if self.closing:
+                break
+
+            delay = self.reconnect_delay
+            self.reconnect_delay = min(max(delay * 2, 0.5), self.max_reconnect_delay)
+            if delay:
+                await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+
+            try:
+                await self.open()
+            except OSError as e:
+                log = self.logger.warning if not delay else self.logger.debug
+                log(f"Reconnecting to MQTT broker failed: {e}, next attempt in {self.reconnect_delay}s")
+
+    async def dispatch_messages(self):
+        while True:
+            on_message, client, userdata, message = await self.inbox.get()
+            try:
+                await on_message(client, userdata, message)
+            except Exception as e:
+                self.logger.error(f"Failed to handle message on {message.topic}: {e}")
+
+    def flush(self):
+        # Write out whatever is queued right away - used on shutdown, when the event loop may not run again
+        for attempt in range(100):
+            if not self.client.want_write() or self.client.loop_write() != mqtt.MQTT_ERR_SUCCESS:
+                break
 
     def disconnect(self):
-        self.client.loop_stop()
+        self.closing = True
+
+        for task in (self.misc, self.dispatcher, self.recovery):
+            if task:
+                task.cancel()
+
+        self.flush()
         self.client.disconnect()
+        self.flush()
+
+        if self.spool:
+            self.spool.close()
+
+    async def drain(self):
+        # Wait until the number of publishes in flight dropped below max_inflight
+        while len(self.inflight) >= self.max_inflight:
+            self.writable.clear()
+            await self.writable.wait()
 
     def subscribe(self, topic, qos=0):
-        self.client.subscribe(topic, qos)
+        # Returns a future resolving to the granted QoS once the broker acknowledged the subscription
+        future = self.loop.create_future()
+        rc, mid = self.client.subscribe(topic, qos)
+        self.subscriptions[topic] = qos
+
+        if rc != mqtt.MQTT_ERR_SUCCESS:
+            future.set_result(None)
+        else:
+            self.subscribing[mid] = future
+
+        return future
+
+    async def retained(self, topic_filter, settle=0.5, timeout=3):
+        # Collects the retained messages matching topic_filter as topic -> payload. The broker sends them right
+        # after the SUBACK, so collecting stops once nothing arrived for settle seconds.
+        # Returns None when the subscription was refused or not acknowledged in time.
+        messages = {}
+        received = asyncio.Event()
+
+        def on_retained(client, userdata, message):
+            if message.retain:
+                messages[message.topic] = message.payload
+                received.set()
+
+        self.client.message_callback_add(topic_filter, on_retained)
+        try:
+            granted = await asyncio.wait_for(self.subscribe(topic_filter), timeout)
+            if not granted or granted[0] >= 0x80:
+                self.logger.warning(f"Subscription to {topic_filter} was refused by the broker")
+                return None
+
+            while True:
+                received.clear()
+                try:
+                    await asyncio.wait_for(received.wait(), settle)
+                except asyncio.TimeoutError:
+                    break
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Subscription to {topic_filter} was not acknowledged in time")
+            return None
+        finally:
+            self.client.unsubscribe(topic_filter)
+            self.client.message_callback_remove(topic_filter)
+            self.subscriptions.pop(topic_filter, None)
+
+        return messages
+
+    async def discovery_hashes(self, identifier):
+        # config_topic -> config_hash of the discovery messages the broker retains for this device,
+        # both the per entity and the device discovery
+        # Read concurrently - each read waits for the retained messages to settle
+        retained, device = await asyncio.gather(
+            self.retained(f"homeassistant/+/{identifier}/+/config"),
+            self.retained(f"homeassistant/device/{identifier}/config"),
+        )
+        if retained is None:
+            return None
+
+        retained.update(device or {})
+
+        hashes = {}
+        for topic, payload in retained.items():
+            try:
+                hashes[topic] = json.loads(payload).get("config_hash") if payload else None
+            except (ValueError, AttributeError):
+                hashes[topic] = None
 
-    def publish(self, topic, payload, qos=0, retain=False):
-        self.client.publish(topic, payload, qos, retain)
+        return hashes
+
+    def publish(self, topic, payload, qos=0, retain=False, properties=None, full_topic=None):
+        # Returns a future resolving to True once the message was handed to the broker (acknowledged for QoS > 0),
+        # False if it was dropped. Callers that don't care about delivery can ignore it.
+        # full_topic is the topic behind a topic alias - a spooled message is sent again on a new connection, where
+        # the alias means nothing, so it is spooled with the full topic and without properties
+        full_topic = full_topic or topic
+        future = self.loop.create_future()
+        info = self.client.publish(topic, payload, qos, retain, properties)
+
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            self.logger.debug(f"Publishing to {topic} failed: {mqtt.error_string(info.rc)}")
+            if self.spool is not None and full_topic:
+                self.spool.put(full_topic, payload, qos, retain)
+            future.set_result(False)
+        elif info.is_published():
+            future.set_result(True)
+        else:
+            message = (full_topic, payload, qos, retain) if qos == 0 and full_topic and self.spool is not None else None
+            self.inflight[info.mid] = (future, message)
+
+        return future
 
     def publish_availability(self, identifier, state):
-        self.client.publish(f"evseMQTT/{identifier}/availability", state, 0, True)
-        
+        self.availability[identifier] = state
+        return self.publish(f"evseMQTT/{identifier}/availability", state, 0, True)
+
     def publish_state(self, identifier, topic, state):
-        self.client.publish(f"evseMQTT/{identifier}/state/{topic}", json.dumps(state))
+        if self.publish_filter and not self.publish_filter.should_publish(identifier, topic, state):
+            return None
+
+        name = f"evseMQTT/{identifier}/state/{topic}"
+        payload = self.serializer.encode(identifier, topic, state)
+
+        if not self.topic_alias_maximum:
+            return self.publish(name, payload)
+
+        # The first publish maps the alias to the topic, later ones send the alias with an empty topic
+        alias = self.topic_aliases.get(name)
+        properties = Properties(PacketTypes.PUBLISH)
+
+        if alias is not None:
+            properties.TopicAlias = alias
+            return self.publish("", payload, properties=properties, full_topic=name)
 
-    def publish_discovery(self, discovery_payload):
+        if len(self.topic_aliases) < self.topic_alias_maximum:
+            alias = len(self.topic_aliases) + 1
+            properties.TopicAlias = alias
+            future = self.publish(name, payload, properties=properties)
+
+            # The broker only learns the alias from a publish the connected client took - a rejected one is spooled
+            # and sent again with its full topic
+            if not future.done() or future.result():
+                self.topic_aliases[name] = alias
+            return future
+
+        return self.publish(name, payload)
+
+    async def publish_discovery(self, discovery_payload, known=None, settle=1.0):
+        # known maps config topics to the config_hash already retained on the broker - only entities whose payload
+        # changed are published, and retained configs of entities that are gone are cleared.
+        # Returns config_topic -> config_hash of what the broker holds afterwards.
         if isinstance(discovery_payload, list):
+            known = known or {}
+            hashes = {element["config_topic"]: element.get("config_hash") for element in discovery_payload}
+            published = 0
+
+            # Cleared first, and given time to be processed: switching the discovery mode moves the same unique ids
+            # to other topics, and Home Assistant rejects them while the old configs still exist
+            stale = [topic for topic in known if topic not in hashes and known[topic] is not None]
+            if stale:
+                cleared = []
+                for topic in stale:
+                    await self.drain()
+                    cleared.append(self.publish(topic, b'', qos=1, retain=True))
+                await asyncio.gather(*cleared)
+                await asyncio.sleep(settle)
+
             for element in discovery_payload:
-                self.client.publish(element["config_topic"], json.dumps(element), retain=True)
+                topic = element["config_topic"]
+
+                if hashes[topic] is not None and known.get(topic) == hashes[topic]:
+                    continue
+
+                await self.drain()
+                self.publish(topic, json.dumps(element, separators=(',', ':')), retain=True)
+                published += 1
+
+            self.logger.info(f"Discovery: {published} of {len(discovery_payload)} entities published, {len(stale)} cleared, the rest is unchanged")
+            self.connected = True
+            return hashes
         else:
-            self.client.publish(f'homeassistant/{discovery_payload["device_class"]}/{discovery_payload["unique_id"]}/config', json.dumps(discovery_payload), retain=True)
+            self.publish(f'homeassistant/{discovery_payload["device_class"]}/{discovery_payload["unique_id"]}/config', json.dumps(discovery_payload), retain=True)
         self.connected = True
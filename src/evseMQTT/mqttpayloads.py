@@ -1,9 +1,35 @@
+import hashlib
 import json
 from .constants import Constants
 
 class MQTTPayloads:
-    def __init__(self, device):
+    # Abbreviations Home Assistant accepts in discovery payloads, used by the compact device discovery
+    ABBREVIATIONS = {
+        "availability_topic": "avty_t",
+        "command_template": "cmd_tpl",
+        "command_topic": "cmd_t",
+        "device_class": "dev_cla",
+        "enabled_by_default": "en",
+        "entity_category": "ent_cat",
+        "icon": "ic",
+        "options": "ops",
+        "payload_available": "pl_avail",
+        "payload_not_available": "pl_not_avail",
+        "payload_off": "pl_off",
+        "payload_on": "pl_on",
+        "state_class": "stat_cla",
+        "state_topic": "stat_t",
+        "unique_id": "uniq_id",
+        "unit_of_measurement": "unit_of_meas",
+        "value_template": "val_tpl",
+    }
+
+    # Shared by every component of the device discovery, so they are only sent once
+    SHARED = ("availability_topic", "payload_available", "payload_not_available")
+
+    def __init__(self, device, discovery_mode="entity"):
         self.device = device
+        self.discovery_mode = discovery_mode  # "entity": one message per entity, "device": one message per charger
         
         self.base_device = {
             "device": {
@@ -42,7 +68,7 @@ class MQTTPayloads:
                 "availability_topic": f"evseMQTT/{self.device.info['serial']}/availability",
                 "payload_available": "online",
                 "payload_not_available": "offline",
-                "options": list(set(Constants.ERRORS.values())),
+                "options": sorted(set(Constants.ERRORS.values())),
                 "value_template": "{{ value_json.error_details }}",
                 "entity_category": "diagnostic"
             },
@@ -55,7 +81,7 @@ class MQTTPayloads:
                 "availability_topic": f"evseMQTT/{self.device.info['serial']}/availability",
                 "payload_available": "online",
                 "payload_not_available": "offline",
-                "options": list(set(Constants.CHARGING_STATUS.values())),
+                "options": sorted(set(Constants.CHARGING_STATUS.values())),
                 "value_template": "{{ value_json.charging_status }}",
                 "entity_category": "diagnostic"
             },
@@ -68,7 +94,7 @@ class MQTTPayloads:
                 "availability_topic": f"evseMQTT/{self.device.info['serial']}/availability",
                 "payload_available": "online",
                 "payload_not_available": "offline",
-                "options": list(set(Constants.CHARGING_STATUS_DESCRIPTIONS.values())),
+                "options": sorted(set(Constants.CHARGING_STATUS_DESCRIPTIONS.values())),
                 "value_template": "{{ value_json.charging_status_description }}",
             },
             "current_state": {
@@ -111,6 +137,7 @@ class MQTTPayloads:
             },
             "device_date": {
                 "name": "Date",
+                "device_type": "sensor",
                 "icon": "mdi:calendar-month-outline",
                 "unique_id": f"{self.device.info['serial']}",
                 "enabled_by_default": False,
@@ -121,6 +148,7 @@ class MQTTPayloads:
             },
             "device_time": {
                 "name": "Time",
+                "device_type": "sensor",
                 "icon": "mdi:clock-outline",
                 "unique_id": f"{self.device.info['serial']}",
                 "enabled_by_default": False,
@@ -399,24 +427,80 @@ class MQTTPayloads:
         if self.device.info['phases'] == 3:
             self.entities.update(self.phase_entities)
 
-    def discovery(self):  
-        discovery_entities = []
-        
+        # Built on first use by discovery()
+        self.payloads = None
+
+    def discovery(self):
+        # The entity definitions are left untouched, so calling this again gives the same payloads
+        if self.payloads is None:
+            if self.discovery_mode == "device":
+                self.payloads = [self.build_device()]
+            else:
+                self.payloads = [self.build(entity, data) for entity, data in self.entities.items()]
+
+        return self.payloads
+
+    def build(self, entity, data):
+        temp_entity = dict(data)
+        device_class = temp_entity.pop('device_type', None) or temp_entity.get('device_class')
+
+        temp_entity.update({"unique_id": f"{data['unique_id']}_{entity}"})
+        temp_entity.update({"config_topic": f"homeassistant/{device_class}/{data['unique_id']}/{entity}/config"})
+        temp_entity.update(self.base_device)
+        temp_entity.update({"config_hash": self.content_hash(temp_entity)})
+
+        return temp_entity
+
+    def build_device(self):
+        # One document listing every entity as a component - topics are relative to "~"
+        serial = self.device.info['serial']
+        base = f"evseMQTT/{serial}"
+        components = {}
+
         for entity, data in self.entities.items():
-            
-            if "device_class" in data:
-                device_class = data['device_class']
-            
-            if "device_type" in data:
-                device_class = data['device_type']
-                data.pop('device_type')
-            
-            temp_entity = {}
-            temp_entity.update(data)
-            temp_entity.update({"unique_id": f"{data['unique_id']}_{entity}"})
-            temp_entity.update({"config_topic": f"homeassistant/{device_class}/{data['unique_id']}/{entity}/config"})
-            temp_entity.update(self.base_device)
-            
-            discovery_entities.append(temp_entity)
-    
-        return discovery_entities
\ No newline at end of file
+            component = {"p": data.get('device_type') or data.get('device_class')}
+            components[entity] = component
+
+            for key, value in data.items():
+                if key == 'device_type' or key in self.SHARED:
+                    continue
+
+                # Switches and selects were published with their platform as device_class
+                if key == 'device_class' and value == component["p"]:
+                    continue
+
+                if key == 'unique_id':
+                    value = f"{value}_{entity}"
+                elif isinstance(value, str) and value.startswith(base):
+                    value = "~" + value[len(base):]
+
+                component[self.ABBREVIATIONS.get(key, key)] = value
+
+        device = self.base_device["device"]
+        payload = {
+            "~": base,
+            "dev": {
+                "ids": device["identifiers"],
+                "name": device["name"],
+                "mf": device["manufacturer"],
+                "mdl": device["model"],
+                "cns": device["connections"],
+                "sn": device["serial_number"],
+                "sw": device["sw_version"],
+            },
+            "o": {"name": "evseMQTT", "sw": Constants.VERSION, "url": "https://github.com/slespersen/evseMQTT"},
+            "avty_t": "~/availability",
+            "pl_avail": "online",
+            "pl_not_avail": "offline",
+            "cmps": components,
+            "config_topic": f"homeassistant/device/{serial}/config",
+        }
+        payload.update({"config_hash": self.content_hash(payload)})
+
+        return payload
+
+    @staticmethod
+    def content_hash(payload):
+        # Stable over restarts: keys are sorted and the hash itself is left out
+        content = {key: value for key, value in payload.items() if key != "config_hash"}
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()[:16]
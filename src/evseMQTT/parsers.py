@@ -1,42 +1,38 @@
 from .constants import Constants
 from .utils import Utils
+from .schema import Schema
 from .mqttpayloads import MQTTPayloads
 
 class Parsers:
-    def login_beacon(data, identifier):
+    def login_beacon(frame):
+        fields = Schema.unpack(1, frame.data)
         return {
-            "serial": identifier,
-            "type": data[0],
-            "phases": Utils.get_phases(data[0]),
-            "manufacturer": data[1:16].strip(b'\x00').decode('utf-8'),
-            "model": data[17:32].strip(b'\x00').decode('utf-8'),
-            "hardware_version": data[33:49].decode('utf-8'),
-            "output_power": Utils.bytes_to_int_little(data[49:53]),
-            "output_max_amps": data[53],
-            "support": data[54:69].strip(b'\x00').decode('utf-8')
+            "serial": frame.identifier,
+            "type": fields['type'],
+            "phases": Utils.get_phases(fields['type']),
+            "manufacturer": fields['manufacturer'].strip(b'\x00').decode('utf-8'),
+            "model": fields['model'].strip(b'\x00').decode('utf-8'),
+            "hardware_version": fields['hardware_version'].decode('utf-8'),
+            "output_power": fields['output_power'],
+            "output_max_amps": fields['output_max_amps'],
+            "support": fields['support'].strip(b'\x00').decode('utf-8')
         }
 
-    def login_response(data, identifier):
-        return {
-            "serial": identifier,
-            "type": data[0],
-            "phases": Utils.get_phases(data[0]),
-            "manufacturer": data[1:16].strip(b'\x00').decode('utf-8'),
-            "model": data[17:32].strip(b'\x00').decode('utf-8'),
-            "hardware_version": data[33:49].decode('utf-8'),
-            "output_power": Utils.bytes_to_int_little(data[49:53]),
-            "output_max_amps": data[53],
-            "support": data[54:69].strip(b'\x00').decode('utf-8')
-        }
+    def login_response(frame):
+        return Parsers.login_beacon(frame)
 
-    def version(data, identifier):
+    def version(frame):
+        fields = Schema.unpack(262, frame.data)
         return {
-            "hardware_version": data[0:15].decode('utf-8'),
-            "software_version": data[16:31].decode('utf-8').strip("\u0000"),
-            "feature": Utils.bytes_to_long_little(data[32:36]),
+            "hardware_version": fields['hardware_version'].decode('utf-8'),
+            "software_version": fields['software_version'].decode('utf-8').strip("\u0000"),
+            "feature": fields['feature'],
         }
 
-    def charge_record(data, identifier):
+    def charge_record(frame):
+        # Not described by a Schema layout yet, so it still slices a copy of the payload
+        data = bytes(frame.data)
+
         log_kw = []
         if len(data) >= 157:
             for i in range(30):
@@ -84,59 +80,62 @@ class Parsers:
             "log_charge_data": log_charge_data
         }
 
-    def charge_status(data, identifier):
+    def charge_status(frame):
+        fields = Schema.unpack(5, frame.data)
         return {
-            "port": Utils.byte_to_integer(data[0]),
-            "current_state": Utils.byte_to_integer(data[1]) if len(data) <= 74 or not Utils.byte_to_integer(data[74]) in [18, 19] else Utils.byte_to_integer(data[74]),
-            "charge_id": data[2:18].strip(b'\x00').decode('utf-8'),
-            "start_type": Utils.byte_to_integer(data[18]),
-            "charge_type": Utils.byte_to_integer(data[19]),
-            "charge_param1": Utils.bytes_to_integer(data[20:22]),
-            "charge_param2": 655.35 if Utils.bytes_to_integer(data[22:24]) == 65535 else Utils.bytes_to_integer(data[22:24]) * 0.01,
-            "charge_param3": 65535.0 if Utils.bytes_to_integer(data[24:26]) == 65535 else Utils.bytes_to_integer(data[24:26]) * 0.01,
-            "reservation_date": Utils.bytes_to_integer(data[26:30], byteorder='little'),
-            "user_id": data[30:46].strip(b'\x00').decode('utf-8'),
-            "max_electricity": Utils.byte_to_integer(data[46]),
-            "start_date": Utils.bytes_to_integer(data[47:51], byteorder='little'),
-            "duration": Utils.bytes_to_integer(data[51:55], byteorder='little'),
-            "start_battery": Utils.bytes_to_integer(data[55:59]) * 0.01,
-            "charge_current_power": Utils.bytes_to_integer(data[59:63]) * 0.01,
-            "number": str(round(Utils.bytes_to_integer(data[63:67]) * 0.01, 2)),
-            "charge_price": Utils.bytes_to_integer(data[67:71], byteorder='little') * 0.01,
-            "fee_type": Utils.byte_to_integer(data[71]),
-            "charge_fee": Utils.bytes_to_integer(data[72:74], byteorder='little') * 0.01
+            "port": fields['port'],
+            "current_state": fields['extended_state'] if fields.get('extended_state') in [18, 19] else fields['current_state'],
+            "charge_id": fields['charge_id'].strip(b'\x00').decode('utf-8'),
+            "start_type": fields['start_type'],
+            "charge_type": fields['charge_type'],
+            "charge_param1": fields['charge_param1'],
+            "charge_param2": 655.35 if fields['charge_param2'] == 65535 else fields['charge_param2'] * 0.01,
+            "charge_param3": 65535.0 if fields['charge_param3'] == 65535 else fields['charge_param3'] * 0.01,
+            "reservation_date": fields['reservation_date'],
+            "user_id": fields['user_id'].strip(b'\x00').decode('utf-8'),
+            "max_electricity": fields['max_electricity'],
+            "start_date": fields['start_date'],
+            "duration": fields['duration'],
+            "start_battery": fields['start_battery'] * 0.01,
+            "charge_current_power": fields['charge_current_power'] * 0.01,
+            "number": str(round(fields['number'] * 0.01, 2)),
+            "charge_price": fields['charge_price'] * 0.01,
+            "fee_type": fields['fee_type'],
+            "charge_fee": fields['charge_fee'] * 0.01
         }
 
-    def single_ac_status(data, identifier):
+    def single_ac_status(frame):
+        fields = Schema.unpack(4, frame.data)
+
         error_info = (
-            f"{int(data[21]):08b}{int(data[22]):08b}" if len(data) < 25 else
-            f"{int(data[21]):08b}{int(data[22]):08b}{int(data[23]):08b}{int(data[24]):08b}"
-        ).replace(' ', '0')
+            f"{fields['error_1']:08b}{fields['error_2']:08b}" if 'error_3' not in fields else
+            f"{fields['error_1']:08b}{fields['error_2']:08b}{fields['error_3']:08b}{fields['error_4']:08b}"
+        )
 
-        plug_state = Utils.byte_to_integer(data[18])
-        current_state = Utils.byte_to_integer(data[20])
+        plug_state = fields['plug_state']
+        current_state = fields['current_state']
 
         failure_details = Utils.get_failure_details(error_info)
         charging_status_code = Utils.charging_status(plug_state, current_state)
 
-        inner_temp = -1.0 if Utils.bytes_to_integer(data[13:15]) == 255 else round((Utils.bytes_to_integer(data[13:15]) - 20000) * 0.01, 1)
+        inner_temp = -1.0 if fields['inner_temp'] == 255 else round((fields['inner_temp'] - 20000) * 0.01, 1)
 
         object = {
-            "line_id": Utils.bytes_to_integer(data[0:1]),
+            "line_id": fields['line_id'],
             "error_info": error_info,
             "error_details": failure_details,
-            "l1_voltage": round(Utils.bytes_to_integer(data[1:3]) * 0.1, 1),
-            "l1_amperage": round(Utils.bytes_to_integer(data[3:5]) * 0.01, 1),
-            "total_energy": round(Utils.bytes_to_int_little(data[5:9]) / 1000, 2),
-            "current_amount": round(Utils.bytes_to_integer(data[9:13]) * 0.01, 1),
+            "l1_voltage": round(fields['l1_voltage'] * 0.1, 1),
+            "l1_amperage": round(fields['l1_amperage'] * 0.01, 1),
+            "total_energy": round(fields['total_energy'] / 1000, 2),
+            "current_amount": round(fields['current_amount'] * 0.01, 1),
             "inner_temp_c": inner_temp,
             "inner_temp_f": Utils.convert_temperature(inner_temp),
-            "outer_temp": -1.0 if Utils.bytes_to_integer(data[15:17]) == 255 else round((Utils.bytes_to_integer(data[15:17]) - 20000) * 0.01, 1),
-            "emergency_btn_state": Utils.byte_to_integer(data[17]),
+            "outer_temp": -1.0 if fields['outer_temp'] == 255 else round((fields['outer_temp'] - 20000) * 0.01, 1),
+            "emergency_btn_state": fields['emergency_btn_state'],
             "plug_state": Constants.PLUG_STATE[plug_state],
-            "output_state": Constants.OUTPUT_STATE[Utils.byte_to_integer(data[19])],
+            "output_state": Constants.OUTPUT_STATE[fields['output_state']],
             "current_state": Constants.CURRENT_STATE[current_state],
-            "new_protocol": 1 if len(data) > 33 else 0,
+            "new_protocol": 1 if len(frame.data) > 33 else 0,
             "charging_status": Constants.CHARGING_STATUS[charging_status_code],
             "charging_status_description": Constants.CHARGING_STATUS_DESCRIPTIONS[charging_status_code],
             "charger_status": Constants.CHARGER_STATUS[charging_status_code]
@@ -151,13 +150,12 @@ class Parsers:
             # Calculating power for single phase in W
             object['current_energy'] = l1_power
 
-        # Parsing additional fields if data length exceeds 25
-        l2_voltage, l2_amperage, l3_voltage, l3_amperage = None, None, None, None
-        if len(data) > 25:
-            object['l2_voltage'] = round(Utils.bytes_to_integer(data[25:27]) * 0.1, 1)
-            object['l2_amperage'] = round(Utils.bytes_to_integer(data[27:29]) * 0.01, 1)
-            object['l3_voltage'] = round(Utils.bytes_to_integer(data[29:31]) * 0.1, 1)
-            object['l3_amperage'] = round(Utils.bytes_to_integer(data[31:33]) * 0.01, 1)
+        # Parsing additional fields if the frame carries the extra phases
+        if 'l2_voltage' in fields:
+            object['l2_voltage'] = round(fields['l2_voltage'] * 0.1, 1)
+            object['l2_amperage'] = round(fields['l2_amperage'] * 0.01, 1)
+            object['l3_voltage'] = round(fields['l3_voltage'] * 0.1, 1)
+            object['l3_amperage'] = round(fields['l3_amperage'] * 0.01, 1)
             
             # Calculating additional phases in W
             l2_power = object['l2_voltage'] * object['l2_amperage']
@@ -169,19 +167,19 @@ class Parsers:
         # Parsing the main return dictionary
         return object
 
-    def output_amps(data, identifier):
+    def output_amps(frame):
         return {
-            "charge_amps": Utils.byte_to_integer(data[1])
+            "charge_amps": Schema.unpack(263, frame.data)['value']
         }
 
-    def name(data, identifier):
+    def name(frame):
         return {
-            "device_name": data[1:32].replace(b'\x00', b'').decode('utf-8', errors='replace').strip()
+            "device_name": Schema.unpack(264, frame.data)['device_name'].replace(b'\x00', b'').decode('utf-8', errors='replace').strip()
         }
 
     #@staticmethod
-    def system_time(data, identifier):
-        epoch = Utils.bytes_to_int_little(data[1:5])
+    def system_time(frame):
+        epoch = Schema.unpack(257, frame.data)['system_time']
         local_time = Utils.bytes_to_timestamp(epoch)
         local_epoch = Utils.bytes_to_timezoned_epoch(epoch)
 
@@ -190,28 +188,30 @@ class Parsers:
             "system_time_raw": local_epoch
         }
 
-    def system_language(data, identifier):
+    def system_language(frame):
         return {
-            "language": Utils.get_key_by_value(Constants.LANGUAGES, Utils.byte_to_integer(data[1]))
+            "language": Utils.get_key_by_value(Constants.LANGUAGES, Schema.unpack(271, frame.data)['value'])
         }
 
-    def system_temperature_unit(data, identifier):
+    def system_temperature_unit(frame):
         return {
-            "temperature_unit": Utils.get_key_by_value(Constants.TEMPERATURE_UNIT, Utils.byte_to_integer(data[1]))
+            "temperature_unit": Utils.get_key_by_value(Constants.TEMPERATURE_UNIT, Schema.unpack(274, frame.data)['value'])
         }
 
-    def charge_start(data, identifier):
+    def charge_start(frame):
+        fields = Schema.unpack(7, frame.data)
         return {
-            "line_id": Utils.byte_to_integer(data[0]),
-            "reservation_result": Constants.CHARGE_START_RESERVATION[Utils.byte_to_integer(data[1])],
-            "start_result": Utils.byte_to_integer(data[2]),
-            "error_reason": Constants.CHARGE_START_ERROR[Utils.byte_to_integer(data[3])],
-            "output_amps": Utils.byte_to_integer(data[4]),
+            "line_id": fields['line_id'],
+            "reservation_result": Constants.CHARGE_START_RESERVATION[fields['reservation_result']],
+            "start_result": fields['start_result'],
+            "error_reason": Constants.CHARGE_START_ERROR[fields['error_reason']],
+            "output_amps": fields['output_amps'],
         }
 
-    def charge_stop(data, identifier):
+    def charge_stop(frame):
+        fields = Schema.unpack(8, frame.data)
         return {
-            "line_id": Utils.byte_to_integer(data[0]),
-            "stop_result": Constants.STOP_REASON[Utils.byte_to_integer(data[1])],
-            "error_reason": Utils.byte_to_integer(data[2]),
-        }
\ No newline at end of file
+            "line_id": fields['line_id'],
+            "stop_result": Constants.STOP_REASON[fields['stop_result']],
+            "error_reason": fields['error_reason'],
+        }
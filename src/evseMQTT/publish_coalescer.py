@@ -0,0 +1,62 @@
+import asyncio
+from .constants import Constants
+
+class PublishCoalescer:
+    def __init__(self, publish, window=0.25, min_intervals=None, priority_fields=None, logger=None):
+        self.publish = publish  # Called as publish(identifier, topic, state), e.g. MQTTClient.publish_state
+        self.window = window
+        self.min_intervals = dict(min_intervals or {})  # topic -> minimum seconds between two publishes
+        self.priority_fields = tuple(Constants.PUBLISH_PRIORITY_FIELDS if priority_fields is None else priority_fields)
+        self.logger = logger
+
+        self.pending = {}  # (identifier, topic) -> latest state not yet published
+        self.timers = {}  # (identifier, topic) -> TimerHandle flushing it
+        self.last_sent = {}  # (identifier, topic) -> (time, state)
+        self.coalesced = 0
+
+    def submit(self, identifier, topic, state):
+        key = (identifier, topic)
+
+        if key in self.pending:
+            self.coalesced += 1
+        self.pending[key] = state
+
+        # First state, and changes to the fields people act on, go out right away
+        if self.is_priority(key, state):
+            self.flush(key)
+            return
+
+        if key not in self.timers:
+            loop = asyncio.get_running_loop()
+            delay = self.window
+
+            min_interval = self.min_intervals.get(topic)
+            if min_interval and key in self.last_sent:
+                delay = max(delay, self.last_sent[key][0] + min_interval - loop.time())
+
+            self.timers[key] = loop.call_later(delay, self.flush, key)
+
+    def is_priority(self, key, state):
+        if key not in self.last_sent:
+            return True
+
+        sent = self.last_sent[key][1]
+        return any(field in state and state[field] != sent.get(field) for field in self.priority_fields)
+
+    def flush(self, key):
+        timer = self.timers.pop(key, None)
+        if timer:
+            timer.cancel()
+
+        if key not in self.pending:
+            return
+
+        state = self.pending.pop(key)
+        self.last_sent[key] = (asyncio.get_event_loop().time(), state)
+
+        identifier, topic = key
+        self.publish(identifier, topic, state)
+
+    def flush_all(self):
+        for key in list(self.pending):
+            self.flush(key)
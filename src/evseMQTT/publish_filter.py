@@ -0,0 +1,59 @@
+import time
+from .constants import Constants
+
+class PublishFilter:
+    def __init__(self, deadbands=None, max_silence=300, clock=time.monotonic, relative_deadbands=None):
+        self.deadbands = dict(Constants.PUBLISH_DEADBANDS if deadbands is None else deadbands)
+        self.relative_deadbands = dict(Constants.PUBLISH_RELATIVE_DEADBANDS if relative_deadbands is None else relative_deadbands)
+        self.max_silence = max_silence  # Seconds before an unchanged state is published anyway, as a keepalive
+        self.clock = clock
+        self.last_published = {}  # (identifier, topic) -> (state, time)
+        self.suppressed = 0
+
+    def should_publish(self, identifier, topic, state):
+        key = (identifier, topic)
+        now = self.clock()
+        last = self.last_published.get(key)
+
+        if last is None or now - last[1] >= self.max_silence or self.changed(last[0], state):
+            # Device snapshots are immutable, so keeping a reference is enough
+            self.last_published[key] = (state, now)
+            return True
+
+        self.suppressed += 1
+        return False
+
+    def changed(self, previous, state):
+        if previous is state:
+            return False
+
+        if previous.keys() != state.keys():
+            return True
+
+        for key, value in state.items():
+            old = previous[key]
+
+            if value == old:
+                continue
+
+            # Compared against the last published value, so slow drift is still published once it adds up
+            deadband = self.deadbands.get(key)
+            relative = self.relative_deadbands.get(key)
+            if (deadband is None and relative is None) or not isinstance(value, (int, float)) or not isinstance(old, (int, float)):
+                return True
+
+            if relative is not None:
+                deadband = max(deadband or 0, relative * abs(old))
+
+            if abs(value - old) >= deadband:
+                return True
+
+        return False
+
+    def reset(self, identifier=None):
+        # Forget what was published, so the next state goes out in full (e.g. after a reconnect)
+        if identifier is None:
+            self.last_published.clear()
+        else:
+            for key in [key for key in self.last_published if key[0] == identifier]:
+                del self.last_published[key]
@@ -0,0 +1,146 @@
+import asyncio
+import collections
+import time
+from .command_queue import CommandQueue
+
+class ResponseTracker:
+    # Futures for commands waiting on the charger's response. The response to a command is the command
+    # minus 0x8000 - e.g. 33031 (output amps) is answered by 263, 32775 (charge start) by 7.
+    #
+    # A response resolves every request pending for it: the charger reports the current state, and the command
+    # queue may have merged several requests into one frame. A request that isn't answered in time is sent
+    # again, up to its number of retries, then its future fails with a TimeoutError. It isn't sent again while a
+    # newer request for the same thing is pending - that one's response answers both.
+    RESPONSE_OFFSET = 0x8000
+    SUPERSEDED_BY = {32775: 32776}  # A charge start by a later charge stop
+
+    def __init__(self, logger, resend):
+        self.logger = logger
+        self.resend = resend  # Coroutine function queueing a frame again
+        self.pending = collections.defaultdict(list)  # response cmd -> [future, cmd, frame, timeout, retries left, timer, sent at]
+
+        # Counters
+        self.requested = 0
+        self.answered = 0
+        self.retried = 0
+        self.timed_out = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def expect(self, cmd, frame, timeout, retries):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        future.add_done_callback(self.report)
+
+        entry = [future, cmd, frame, timeout, retries, None, time.monotonic()]
+        entry[5] = loop.call_later(timeout, self.expire, entry)
+        self.pending[cmd - self.RESPONSE_OFFSET].append(entry)
+        self.requested += 1
+
+        return future
+
+    def resolve(self, response, data):
+        entries = self.pending.pop(response, None)
+        if not entries:
+            return False
+
+        now = time.monotonic()
+        for future, cmd, frame, timeout, retries, timer, sent in entries:
+            timer.cancel()
+            if not future.done():
+                future.set_result(data)
+                self.answered += 1
+                self.latency_total += now - sent
+                self.latency_max = max(self.latency_max, now - sent)
+
+        return True
+
+    def expire(self, entry):
+        future, cmd, frame, timeout, retries, timer, sent = entry
+
+        if future.done():
+            self.discard(entry)
+            return
+
+        if retries > 0:
+            entry[4] = retries - 1
+            entry[5] = asyncio.get_running_loop().call_later(timeout, self.expire, entry)
+
+            if self.superseded(entry):
+                self.logger.debug(f"No response to {cmd} within {timeout}s - not sending it again, a newer request is pending")
+                return
+
+            self.logger.debug(f"No response to {cmd} within {timeout}s - sending it again, {retries} retries left")
+            self.retried += 1
+            asyncio.ensure_future(self.resend(frame))
+            return
+
+        self.discard(entry)
+        self.timed_out += 1
+        future.set_exception(asyncio.TimeoutError(f"No response to command {cmd}"))
+
+    def superseded(self, entry):
+        # An older write sent again would replace the newer value still queued, and an old charge start must not
+        # follow a newer stop
+        future, cmd, frame, timeout, retries, timer, sent = entry
+        entries = self.pending.get(cmd - self.RESPONSE_OFFSET, [])
+        later = entries[next((index for index, other in enumerate(entries) if other is entry), len(entries)) + 1:]
+
+        if any(CommandQueue.classify(other[2]) == CommandQueue.classify(frame) for other in later):
+            return True
+
+        stop = self.SUPERSEDED_BY.get(cmd)
+        return stop is not None and any(other[6] > sent for other in self.pending.get(stop - self.RESPONSE_OFFSET, []))
+
+    def discard(self, entry):
+        response = entry[1] - self.RESPONSE_OFFSET
+        entries = self.pending.get(response)
+
+        if entries and entry in entries:
+            entries.remove(entry)
+            if not entries:
+                del self.pending[response]
+
+    def withdraw(self, frame):
+        # The frame was never queued - its request is cancelled instead of timing out and being sent after all
+        for entries in list(self.pending.values()):
+            for entry in [entry for entry in entries if entry[2] is frame]:
+                entry[5].cancel()
+                entry[0].cancel()
+                self.discard(entry)
+
+    def fail(self, frame, error):
+        # The frame couldn't be written - the requests it carried fail with the error right away. Requests merged
+        # into it by the command queue went with it.
+        key = CommandQueue.classify(frame)
+        for entries in list(self.pending.values()):
+            for entry in [entry for entry in entries if CommandQueue.classify(entry[2]) == key]:
+                entry[5].cancel()
+                self.discard(entry)
+                if not entry[0].done():
+                    entry[0].set_exception(error)
+
+    def report(self, future):
+        # Every failure is logged here, so it is never an unretrieved exception when the caller didn't wait
+        if not future.cancelled() and future.exception() is not None:
+            self.logger.warning(f"{future.exception()}")
+
+    def cancel(self):
+        # The link is gone - nothing pending will be answered
+        for entries in self.pending.values():
+            for future, cmd, frame, timeout, retries, timer, sent in entries:
+                timer.cancel()
+                future.cancel()
+
+        self.pending.clear()
+
+    def stats(self):
+        return {
+            "pending": sum(len(entries) for entries in self.pending.values()),
+            "requested": self.requested,
+            "answered": self.answered,
+            "retried": self.retried,
+            "timed_out": self.timed_out,
+            "latency_avg_ms": round(self.latency_total / self.answered * 1000, 1) if self.answered else 0.0,
+            "latency_max_ms": round(self.latency_max * 1000, 1),
+        }
@@ -0,0 +1,91 @@
+import asyncio
+from bleak import BleakScanner, BleakError
+
+class Scanner:
+    # Long-lived BLE scanner. Advertisements are handled as they arrive: every evse seen is remembered, and the
+    # RSSI of watched addresses is smoothed with an exponential moving average. A watcher is only called when
+    # the smoothed value moved by at least threshold dB since it was last reported.
+    #
+    # The scanner runs in a duty cycle - scanning for window seconds, then pausing. The pause doubles up to
+    # max_interval while the signal is stable and drops back to min_interval when it changes, so a steady link
+    # isn't competing with the scanner for the radio.
+
+    def __init__(self, logger, smoothing=0.3, threshold=3, window=5, min_interval=10, max_interval=300, adapter=None):
+        self.logger = logger
+        self.adapter = adapter  # e.g. hci1, None for the default adapter
+        self.smoothing = smoothing
+        self.threshold = threshold
+        self.window = window
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+
+        self.devices = {}  # address -> BLEDevice of every evse seen
+        self.rssi = {}  # address -> smoothed RSSI
+        self.reported = {}  # address -> RSSI last passed to the watcher
+        self.watchers = {}  # address -> callback(rssi)
+        self.changed = False
+
+        self.scanner = None  # Created on first use, inside the event loop
+        self.task = None
+
+    def watch(self, address, callback):
+        self.watchers[address] = callback
+
+    def unwatch(self, address):
+        self.watchers.pop(address, None)
+        self.rssi.pop(address, None)
+        self.reported.pop(address, None)
+
+        if not self.watchers and self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def serve(self):
+        # Shared by every watcher - the scan loop runs once, however many chargers track their RSSI
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        await asyncio.shield(self.task)
+
+    def detection(self, device, advertisement):
+        address = device.address
+
+        if address not in self.watchers and not (device.name and "ACP#" in device.name):
+            return
+
+        self.devices[address] = device
+
+        callback = self.watchers.get(address)
+        if callback is None:
+            return
+
+        smoothed = self.rssi.get(address)
+        smoothed = advertisement.rssi if smoothed is None else smoothed + self.smoothing * (advertisement.rssi - smoothed)
+        self.rssi[address] = smoothed
+
+        reported = self.reported.get(address)
+        if reported is None or abs(smoothed - reported) >= self.threshold:
+            self.reported[address] = round(smoothed)
+            self.changed = True
+            callback(self.reported[address])
+
+    async def run(self):
+        if self.scanner is None:
+            self.scanner = BleakScanner(detection_callback=self.detection, **({"adapter": self.adapter} if self.adapter else {}))
+
+        while True:
+            self.changed = False
+
+            try:
+                await self.scanner.start()
+                try:
+                    await asyncio.sleep(self.window)
+                finally:
+                    await self.scanner.stop()
+            except BleakError as e:
+                self.logger.warning(f"BleakError during scanning: {e}")
+
+            # Back off while nothing changed, scan often again once it did
+            self.interval = self.min_interval if self.changed else min(self.interval * 2, self.max_interval)
+            self.logger.debug(f"Next RSSI scan in {self.interval}s")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,110 @@
+import struct
+
+class Layout:
+    def __init__(self, segments, optional=()):
+        # A segment is (offset, struct format, field names) - segments allow mixing byte orders,
+        # optional segments are only decoded when the payload is long enough to hold them
+        self.segments = [(offset, struct.Struct(fmt), names, False) for offset, fmt, names in segments]
+        self.segments += [(offset, struct.Struct(fmt), names, True) for offset, fmt, names in optional]
+        self.size = max((offset + compiled.size for offset, compiled, names, is_optional in self.segments if not is_optional), default=0)
+        self.names = [name for offset, compiled, names, is_optional in self.segments for name in names]
+
+        # Reused by pack() - the returned memoryview is only valid until the next call
+        self.buffer = bytearray(self.size)
+
+    def unpack(self, data):
+        # Short payloads are zero padded, matching the old slicing behaviour
+        if len(data) < self.size:
+            data = bytes(data).ljust(self.size, b'\x00')
+
+        fields = {}
+        for offset, compiled, names, is_optional in self.segments:
+            if is_optional and len(data) < offset + compiled.size:
+                continue
+            fields.update(zip(names, compiled.unpack_from(data, offset)))
+
+        return fields
+
+    def pack(self, *values):
+        if len(values) != len(self.names):
+            raise ValueError(f"Expected {len(self.names)} values ({', '.join(self.names)}), got {len(values)}")
+
+        index = 0
+        for offset, compiled, names, is_optional in self.segments:
+            if not is_optional:
+                compiled.pack_into(self.buffer, offset, *values[index:index + len(names)])
+                index += len(names)
+
+        return memoryview(self.buffer)
+
+class Schema:
+    # Charger -> host messages
+    LOGIN = Layout([
+        (0, '>B15sx15sx16sIB15s', ('type', 'manufacturer', 'model', 'hardware_version', 'output_power', 'output_max_amps', 'support')),
+    ])
+
+    CHARGE_STATUS = Layout([
+        (0, '>BB16sBBHHH', ('port', 'current_state', 'charge_id', 'start_type', 'charge_type', 'charge_param1', 'charge_param2', 'charge_param3')),
+        (26, '<I', ('reservation_date',)),
+        (30, '>16sB', ('user_id', 'max_electricity')),
+        (47, '<II', ('start_date', 'duration')),
+        (55, '>III', ('start_battery', 'charge_current_power', 'number')),
+        (67, '<I', ('charge_price',)),
+        (71, '>B', ('fee_type',)),
+        (72, '<H', ('charge_fee',)),
+    ], optional=[
+        (74, '>B', ('extended_state',)),
+    ])
+
+    SINGLE_AC_STATUS = Layout([
+        (0, '>BHHIIHHBBBBBB', ('line_id', 'l1_voltage', 'l1_amperage', 'total_energy', 'current_amount', 'inner_temp', 'outer_temp',
+                               'emergency_btn_state', 'plug_state', 'output_state', 'current_state', 'error_1', 'error_2')),
+    ], optional=[
+        (23, '>BB', ('error_3', 'error_4')),
+        (25, '>HHHH', ('l2_voltage', 'l2_amperage', 'l3_voltage', 'l3_amperage')),
+    ])
+
+    CONFIG_BYTE = Layout([(0, '>xB', ('value',))])
+
+    # Host -> charger payloads
+    ACTION = Layout([(0, '>B', ('action',))])
+    QUERY = Layout([(0, '>BB', ('action', 'value'))])  # (2, 0) reads any of the 330xx settings
+
+    LAYOUTS = {
+        1: LOGIN,
+        2: LOGIN,
+        4: SINGLE_AC_STATUS,
+        5: CHARGE_STATUS,
+        6: CHARGE_STATUS,
+        7: Layout([(0, '>BBBBB', ('line_id', 'reservation_result', 'start_result', 'error_reason', 'output_amps'))]),
+        8: Layout([(0, '>BBB', ('line_id', 'stop_result', 'error_reason'))]),
+        13: SINGLE_AC_STATUS,
+        257: Layout([(0, '>xI', ('system_time',))]),
+        262: Layout([(0, '>15sx15sxI', ('hardware_version', 'software_version', 'feature'))]),
+        263: CONFIG_BYTE,
+        264: Layout([(0, '>x31s', ('device_name',))]),
+        271: CONFIG_BYTE,
+        274: CONFIG_BYTE,
+        32769: ACTION,
+        32771: ACTION,
+        32775: Layout([(0, '>B16s16sBIBBHHHB', ('line_id', 'user_id', 'charge_id', 'is_reservation', 'start_date', 'start_type',
+                                                'charge_type', 'charge_param1', 'charge_param2', 'charge_param3', 'max_amps'))]),
+        32776: Layout([(0, '>B16s30x', ('line_id', 'user_id'))]),
+        33025: Layout([(0, '>BI', ('action', 'timestamp'))]),
+        33026: Layout([(0, '>6s', ('password',))]),
+        33028: Layout([(0, '>BBH', ('action', 'fee_type', 'fee'))]),
+        33029: Layout([(0, '>BBH', ('action', 'fee_type', 'fee'))]),
+        33031: QUERY,
+        33032: Layout([(0, '>B32s', ('action', 'device_name'))]),
+        33039: QUERY,
+        33042: QUERY,
+        33122: Layout([(0, '>BBBB4x', ('line_id', 'action', 'brightness', 'query'))]),
+    }
+
+    @staticmethod
+    def unpack(cmd, data):
+        return Schema.LAYOUTS[cmd].unpack(data)
+
+    @staticmethod
+    def pack(cmd, *values):
+        return Schema.LAYOUTS[cmd].pack(*values)
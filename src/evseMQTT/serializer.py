@@ -0,0 +1,72 @@
+import json
+from .constants import Constants
+from .device import Snapshot
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class StateSerializer:
+    def __init__(self, backend=None, static_fields=None):
+        # orjson when it is installed, the standard library otherwise
+        if backend is None:
+            backend = "orjson" if orjson else "json"
+
+        if backend == "orjson":
+            if orjson is None:
+                raise ImportError("orjson is not installed - pip install evseMQTT[fast]")
+            self.dumps = orjson.dumps
+        elif backend == "json":
+            # One encoder instance - json.dumps() with arguments builds a new one for every call
+            encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+            self.dumps = lambda value: encode(value).encode('utf-8')
+        else:
+            raise ValueError(f"Unknown JSON backend: {backend}")
+
+        self.backend = backend
+        self.static_fields = frozenset(Constants.STATIC_STATE_FIELDS if static_fields is None else static_fields)
+        self.layouts = {}  # (topic, keys) -> (static keys, volatile keys)
+        self.fragments = {}  # (topic, static values) -> encoded static fields, without braces
+        self.last = {}  # (identifier, topic) -> (state, payload), reused when the same snapshot is published again
+
+    def encode(self, identifier, topic, state):
+        # Device snapshots are immutable and cached until something changes, so the same object encodes the same
+        last = self.last.get((identifier, topic))
+        if last is not None and last[0] is state:
+            return last[1]
+
+        if self.static_fields.isdisjoint(state):
+            payload = self.dumps(state)
+        else:
+            payload = self.encode_split(topic, state)
+
+        if isinstance(state, Snapshot):
+            self.last[(identifier, topic)] = (state, payload)
+
+        return payload
+
+    def encode_split(self, topic, state):
+        # Which keys are static only depends on the keys of the state, which are fixed per topic for Device snapshots
+        keys = tuple(state)
+        layout = self.layouts.get((topic, keys))
+
+        if layout is None:
+            layout = (
+                tuple(key for key in keys if key in self.static_fields),
+                tuple(key for key in keys if key not in self.static_fields),
+            )
+            self.layouts[(topic, keys)] = layout
+
+        static_keys, volatile_keys = layout
+        static = (topic, tuple(state[key] for key in static_keys))
+        fragment = self.fragments.get(static)
+
+        if fragment is None:
+            fragment = self.dumps({key: state[key] for key in static_keys})[1:-1]
+            self.fragments[static] = fragment
+
+        if not volatile_keys:
+            return b'{' + fragment + b'}'
+
+        return b'{' + fragment + b',' + self.dumps({key: state[key] for key in volatile_keys})[1:]
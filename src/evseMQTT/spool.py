@@ -0,0 +1,137 @@
+import mmap
+import os
+import struct
+
+class Spool:
+    # Outbound messages kept while the broker is unreachable. The latest message per topic is always kept,
+    # the optional tail keeps every message in a ring buffer on a memory mapped file, dropping the oldest
+    # once it is full - so a long outage costs at most capacity bytes, and pages can be written back to the
+    # file instead of using RAM.
+    RECORD = struct.Struct('>IQHB')  # record length, sequence, topic length, flags (qos, retain)
+
+    def __init__(self, logger, capacity=262144, tail=False, path=None, max_topics=1024):
+        self.logger = logger
+        self.capacity = capacity
+        self.tail = tail
+        self.max_topics = max_topics
+
+        self.latest = {}  # topic -> (sequence, payload, qos, retain)
+        self.sequence = 0
+        self.dropped = 0  # Messages lost for good
+        self.trimmed = 0  # Older messages cut from the tail - a newer one of their topic is still kept
+
+        # Ring buffer: records between the start and end positions, count of records in it
+        self.buffer = None
+        self.start = 0
+        self.end = 0
+        self.count = 0
+
+        if tail:
+            if path:
+                os.makedirs(path, exist_ok=True)
+                self.file = open(os.path.join(path, "spool.bin"), "w+b")
+                self.file.truncate(capacity)
+                self.buffer = mmap.mmap(self.file.fileno(), capacity)
+            else:
+                self.file = None
+                self.buffer = mmap.mmap(-1, capacity)
+
+    def __len__(self):
+        return len(self.latest) + self.count
+
+    def put(self, topic, payload, qos=0, retain=False):
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+
+        self.sequence += 1
+
+        if topic not in self.latest and len(self.latest) >= self.max_topics:
+            self.dropped += 1
+            return
+        self.latest[topic] = (self.sequence, bytes(payload), qos, retain)
+
+        if self.tail:
+            self.append(topic.encode('utf-8'), payload, qos, retain)
+
+    def append(self, topic, payload, qos, retain):
+        length = self.RECORD.size + len(topic) + len(payload)
+
+        # Too large for the ring - the latest copy still goes out
+        if length > self.capacity:
+            return
+
+        # Make room by dropping the oldest records
+        while self.end - self.start + length > self.capacity:
+            self.evict()
+
+        self.write(self.end, self.RECORD.pack(length, self.sequence, len(topic), qos | (retain << 2)))
+        self.write(self.end + self.RECORD.size, topic)
+        self.write(self.end + self.RECORD.size + len(topic), payload)
+
+        self.end += length
+        self.count += 1
+
+    # start and end only ever grow - the position in the buffer is taken modulo capacity, records may wrap around
+    def write(self, position, data):
+        offset = position % self.capacity
+        first = min(len(data), self.capacity - offset)
+        self.buffer[offset:offset + first] = data[:first]
+        self.buffer[:len(data) - first] = data[first:]
+
+    def read_bytes(self, position, length):
+        offset = position % self.capacity
+        first = min(length, self.capacity - offset)
+        return self.buffer[offset:offset + first] + self.buffer[:length - first]
+
+    def read(self, position):
+        # Returns the record at position and the position of the next one
+        length, sequence, topic_length, flags = self.RECORD.unpack(self.read_bytes(position, self.RECORD.size))
+        data = self.read_bytes(position + self.RECORD.size, length - self.RECORD.size)
+        topic = data[:topic_length].decode('utf-8')
+
+        return (sequence, topic, data[topic_length:], flags & 0x03, bool(flags & 0x04)), position + length
+
+    def evict(self):
+        length, sequence, topic_length, flags = self.RECORD.unpack(self.read_bytes(self.start, self.RECORD.size))
+        topic = self.read_bytes(self.start + self.RECORD.size, topic_length).decode('utf-8')
+        self.start += length
+        self.count -= 1
+
+        # Every topic in the tail has its latest message kept, so only the history is cut short
+        if topic in self.latest:
+            self.trimmed += 1
+        else:
+            self.dropped += 1
+
+    def pop_all(self):
+        # Everything spooled, oldest first. The latest message of a topic is sent last, so subscribers end up
+        # with the current state even when the tail was cut short.
+        messages = []
+
+        offset = self.start
+        for i in range(self.count):
+            (sequence, topic, payload, qos, retain), offset = self.read(offset)
+            if self.latest.get(topic, (None,))[0] != sequence:
+                messages.append((topic, payload, qos, retain))
+
+        for topic, (sequence, payload, qos, retain) in sorted(self.latest.items(), key=lambda item: item[1][0]):
+            messages.append((topic, payload, qos, retain))
+
+        self.latest.clear()
+        self.start = self.end = self.count = 0
+
+        if self.dropped:
+            self.logger.warning(f"Spool overflowed, {self.dropped} messages were dropped")
+            self.dropped = 0
+
+        if self.trimmed:
+            self.logger.info(f"Spool tail was full, {self.trimmed} older messages were skipped - the latest of each topic is sent")
+            self.trimmed = 0
+
+        return messages
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.close()
+        if self.tail and self.file:
+            self.file.close()
@@ -0,0 +1,32 @@
+import json
+import os
+
+class StateStore:
+    # Small JSON documents kept across restarts, one file per name in the state directory
+    def __init__(self, path, logger):
+        self.path = path
+        self.logger = logger
+        os.makedirs(self.path, exist_ok=True)
+
+    def file(self, name):
+        return os.path.join(self.path, f"{name}.json")
+
+    def load(self, name, default=None):
+        try:
+            with open(self.file(name), encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return default
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring unreadable state file {self.file(name)}: {e}")
+            return default
+
+    def save(self, name, data):
+        # Written next to the target and renamed, so a crash never leaves a half written file behind
+        temp = f"{self.file(name)}.tmp"
+        try:
+            with open(temp, "w", encoding="utf-8") as file:
+                json.dump(data, file, indent=2, sort_keys=True)
+            os.replace(temp, self.file(name))
+        except OSError as e:
+            self.logger.warning(f"Could not write state file {self.file(name)}: {e}")
@@ -0,0 +1,187 @@
+import asyncio
+import random
+import time
+from bleak import BleakError
+
+class Supervisor:
+    # Owns the connection to one charger as a state machine:
+    #
+    #   scan -> connect -> login -> streaming
+    #     ^                  |          |
+    #     +---- backoff <----+----------+
+    #
+    # Any failure - charger not found, connection refused, no login in time, disconnect, or no message for
+    # message_timeout seconds - tears the link down: the consumer task is cancelled, the client disconnected and
+    # the device state reset. The next attempt waits base_delay * 2^failures seconds, capped at max_delay, with
+    # jitter so several bridges don't retry in lockstep.
+    STATES = ("scan", "connect", "login", "streaming", "backoff")
+
+    def __init__(self, ble_manager, address, logger, prepare=None, session=None, on_state=None, login_timeout=30, base_delay=1, max_delay=60):
+        self.ble_manager = ble_manager
+        self.address = address
+        self.logger = logger
+        self.prepare = prepare  # Coroutine function awaited before each attempt
+        self.session = session  # Coroutine function run once connected, part of the login stage
+        self.on_state = on_state  # Called with the new state
+        self.login_timeout = login_timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.state = None
+        self.failures = 0  # Consecutive attempts that didn't reach streaming
+        self.consumer = None
+
+        # Metrics
+        self.attempts = 0
+        self.sessions = 0  # Times the link reached streaming
+        self.reconnects = 0
+        self.downtime = 0.0
+        self.last_downtime = 0.0
+        self.down_since = time.monotonic()
+        self.up_since = None
+
+    def enter(self, state):
+        self.logger.debug(f"Link {self.address}: {self.state} -> {state}")
+        self.state = state
+
+        if self.on_state:
+            self.on_state(state)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "state": self.state,
+            "attempts": self.attempts,
+            "reconnects": self.reconnects,
+            "failures": self.failures,
+            "downtime_s": round(self.downtime + (now - self.down_since if self.up_since is None else 0), 1),
+            "last_downtime_s": round(self.last_downtime, 1),
+            "uptime_s": round(now - self.up_since, 1) if self.up_since is not None else 0.0,
+        }
+
+    async def run(self):
+        while True:
+            # Whatever goes wrong in an attempt is a failed attempt - it must not end the supervision, or with
+            # several chargers, every other charger too
+            try:
+                streamed = await self.attempt()
+            except Exception as e:
+                self.logger.error(f"Connection attempt to {self.address} failed with error: {e}")
+                streamed = False
+
+            if not streamed:
+                self.failures += 1
+
+            delay = min(self.max_delay, self.base_delay * 2 ** self.failures) * random.uniform(0.5, 1)
+            self.enter("backoff")
+            self.logger.info(f"Reconnecting to {self.address} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def attempt(self):
+        # Returns True if the link reached streaming before it went down
+        self.attempts += 1
+
+        if self.prepare:
+            await self.prepare()
+
+        self.enter("scan")
+        try:
+            device = await self.ble_manager.find_device(self.address)
+        except BleakError as e:
+            self.logger.error(f"BleakError while looking for {self.address}: {e}")
+            device = None
+
+        if device is None:
+            self.logger.warning(f"Device {self.address} not found")
+            return False
+
+        self.enter("connect")
+        if not await self.ble_manager.connect_device(self.address):
+            return False
+
+        self.consumer = asyncio.create_task(self.ble_manager.message_consumer(self.address, self.ble_manager.write_uuid))
+        try:
+            self.enter("login")
+            if not await self.until_lost(self.login(), self.login_timeout):
+                self.logger.warning(f"Device {self.address} didn't complete the login")
+                return False
+
+            self.streaming()
+            self.enter("streaming")
+            await self.watch()
+            return True
+        finally:
+            await self.teardown()
+
+    async def login(self):
+        # The session may publish from the device cache before the login completes, so both run side by side
+        await asyncio.gather(self.ble_manager.event_handler.wait_for("logged_in"), self.session() if self.session else asyncio.sleep(0))
+
+    async def until_lost(self, coroutine, timeout):
+        # Runs coroutine unless the link goes down or the timeout passes first, returns whether it completed
+        task = asyncio.ensure_future(coroutine)
+        lost = asyncio.ensure_future(self.ble_manager.link_lost.wait())
+        try:
+            await asyncio.wait({task, lost}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            return task.done() and not task.cancelled() and task.exception() is None
+        finally:
+            for pending in (task, lost):
+                pending.cancel()
+
+    async def watch(self):
+        # Streaming until the charger disconnects or stays silent for too long
+        loop = asyncio.get_running_loop()
+        while True:
+            silence = loop.time() - self.ble_manager.last_message_time
+            if silence >= self.ble_manager.message_timeout:
+                self.logger.warning(f"No message received in the last {self.ble_manager.message_timeout} seconds. Reconnecting.")
+                return
+
+            try:
+                await asyncio.wait_for(self.ble_manager.link_lost.wait(), self.ble_manager.message_timeout - silence)
+                self.logger.warning(f"Link to {self.address} lost. Reconnecting.")
+                return
+            except asyncio.TimeoutError:
+                pass
+
+    def streaming(self):
+        now = time.monotonic()
+        self.last_downtime = now - self.down_since
+        self.downtime += self.last_downtime
+        self.up_since = now
+        self.failures = 0
+        self.sessions += 1
+
+        if self.sessions > 1:
+            self.reconnects += 1
+            self.logger.info(f"Reconnected to {self.address} after {self.last_downtime:.1f}s, {self.reconnects} reconnects so far")
+
+    async def teardown(self):
+        if self.consumer:
+            self.consumer.cancel()
+            await asyncio.gather(self.consumer, return_exceptions=True)
+            self.consumer = None
+
+        # Waits on responses that won't come anymore
+        initial_reads = self.ble_manager.event_handler.initial_reads
+        if initial_reads:
+            initial_reads.cancel()
+            await asyncio.gather(initial_reads, return_exceptions=True)
+            self.ble_manager.event_handler.initial_reads = None
+
+        await self.ble_manager.disconnect_device(self.address)
+
+        if self.up_since is not None:
+            self.down_since = time.monotonic()
+            self.up_since = None
+
+        # Nothing of the old session carries over - queued frames, pending responses, partial frames
+        event_handler = self.ble_manager.event_handler
+        device = event_handler.device
+        device.initialization_state = False
+        device.logged_in = False
+        device.info = {'software_version': None, 'serial': None}
+
+        event_handler.reset()
+        event_handler.commands.reset()
+        self.ble_manager.queue.clear()
@@ -1,78 +1,8 @@
-import struct
 import zoneinfo
 from .constants import Constants
 from datetime import datetime, timezone, timedelta
 
 class Utils:
-    @staticmethod
-    def build_command(serial: int, password: str, cmd: int, data: list[int] = None) -> bytearray:
-        # Flatten data if it contains nested lists
-        if data is not None:
-            flat_data = [] 
-            for item in data: 
-                if isinstance(item, list):
-                    flat_data.extend(item) 
-                else: 
-                    flat_data.append(item)
-            data = flat_data
-        else:
-            data = []
-
-        # Calculate length correctly
-        length = 25 + len(data)
-        
-        packet = bytearray()
-
-        # Add header
-        packet.extend([6, 1])
-
-        # Add length
-        packet.extend(struct.pack('>H', length))
-
-        # Add reserved byte
-        packet.append(0)
-
-        # Add serial (little-endian)
-        packet.extend(struct.pack('<Q', int(serial)))
-
-        # Add password (ASCII bytes)
-        packet.extend(password.encode('ascii'))
-
-        # Add command (2-byte integer)
-        packet.extend(struct.pack('>H', cmd))
-
-        # Add data if it exists
-        if data:
-            packet.extend(data)
-
-        # Calculate checksum (sum of all bytes % 0xFFFF)
-        checksum = sum(packet) % 0xFFFF
-        
-        # Add the checksum (2-byte integer)
-        packet.extend(struct.pack('>H', checksum))
-
-        # Add end-byte
-        packet.extend([15, 2])
-
-        return packet
-        
-    @staticmethod    
-    def parse_bytearray(byte_array: bytearray):
-        # Extract segments based on positions and convert to appropriate formats
-        parsed_data = {
-            "header": byte_array[0:2],
-            "data_length": byte_array[2:4],
-            "reserved": byte_array[4:5],
-            "identifier": Utils.byte_to_string(byte_array[5:13]),
-            "password": byte_array[13:19],
-            "cmd": int.from_bytes(byte_array[19:21], byteorder='big'),
-            "data": byte_array[21:-4],
-            "checksum": byte_array[-4:-2],
-            "end_byte": byte_array[-2:]
-        }
-
-        return parsed_data
-    
     @staticmethod
     def split_message(message):
         # Define the marker and capture the serial bytes
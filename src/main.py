@@ -1,15 +1,18 @@
 import argparse
 import asyncio
+import json
 import logging
 import signal
 import sys
-from evseMQTT import BLEManager, Constants, Device, EventHandlers, Commands, Logger, MQTTClient, MQTTCallback, MQTTPayloads, Utils
+from bleak import BleakError
+from evseMQTT import BLEManager, Constants, Device, DeviceCache, EventHandlers, Commands, Logger, MQTTClient, MQTTCallback, MQTTPayloads, PublishCoalescer, PublishFilter, AdapterPool, Spool, StateSerializer, StateStore, Supervisor, Utils
 
-class Manager:
-    def __init__(self, address, ble_password, unit, mqtt_enabled=False, mqtt_settings=None, logging_level=logging.INFO, rssi=False):
-        self.setup_logging(logging_level)
-        self.logger = logging.getLogger("evseMQTT")
-        debug = logging_level == logging.DEBUG  # Determine if debug logging is enabled
+class Charger:
+    # Everything bound to one charger - its device state, decoder, command queue and connection. The MQTT client,
+    # the Bluetooth adapters and the state directory are shared by all chargers of the manager.
+    def __init__(self, manager, address, ble_password, unit, rssi=False, logger=None):
+        self.manager = manager
+        self.logger = logger or manager.logger
         
         self.device = Device(address)
         
@@ -23,104 +26,354 @@ class Manager:
         self.device.ble_password = ble_password
         
         self.address = address
+        self.supervisor = None
+        self.profile = None
+        self.serial = None  # Serial of the charger, kept while the link is down
+        self.session_tasks = []
+        self.rssi_task = None
+        self.stats_task = None
+        self.discovered = False
+        
+        # Commands for this charger, handled in order - waiting for it doesn't hold up the other chargers
+        self.inbox = asyncio.Queue()
+        self.dispatcher = None
 
         # Correct order of instantiation
         self.commands = Commands(ble_manager=None, device=self.device, logger=self.logger)
-        self.event_handlers = EventHandlers(device=self.device, commands=self.commands, logger=self.logger)
-        self.ble_manager = BLEManager(event_handler=self.event_handlers, logger=self.logger)
-        self.ble_manager.manager = self
+        self.event_handlers = EventHandlers(device=self.device, commands=self.commands, logger=self.logger, callback=manager.publish)
+        self.ble_manager = BLEManager(event_handler=self.event_handlers, logger=self.logger, scanner=manager.adapters.scanners[manager.adapters.adapters[0]])
         
         # Update ble_manager in commands now that it is created
         self.commands.ble_manager = self.ble_manager
 
-        self.mqtt_client = None
         self.mqtt_callback = None
         self.mqtt_payloads = None
-       # self.rssi = rssi
 
-        if mqtt_enabled and mqtt_settings:
-            self.mqtt_client = MQTTClient(logger=self.logger, **mqtt_settings)
-            self.mqtt_client.connect()
-            self.event_handlers.callback = self.mqtt_client.publish_state
+    @property
+    def mqtt_client(self):
+        return self.manager.mqtt_client
 
-    def setup_logging(self, logging_level):
-        logging.basicConfig(level=logging_level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    async def recover_mqtt(self):
+        # The broker may have restarted without its retained messages - check the discovery configs again and
+        # push a fresh snapshot of the state
+        if self.mqtt_payloads is None or self.serial is None:
+            return
+        
+        serial = self.serial
+        hashes = await self.mqtt_client.publish_discovery(self.mqtt_payloads.discovery(), known=await self.known_discovery())
+        
+        if self.manager.state_store:
+            self.manager.state_store.save(f"discovery_{serial}", hashes)
+        
+        if self.mqtt_client.publish_filter:
+            self.mqtt_client.publish_filter.reset(serial)
+        
+        for topic in sorted(set(self.event_handlers.forward_messages.values())):
+            self.mqtt_client.publish_state(serial, topic, getattr(self.device, topic))
+
+    async def confirm_profile(self, profile):
+        # Stores what the live handshake reported, and updates discovery if the charger changed since it was cached -
+        # e.g. after a firmware update
+        device_cache = self.manager.device_cache
+        await self.event_handlers.wait_for("configured")
+        device_cache.save(self.address, self.device, self.ble_manager.write_uuid, self.ble_manager.read_uuid)
+        
+        if profile is None or device_cache.identity(profile["info"]) == device_cache.identity(self.device.info):
+            return
+        
+        self.logger.info(f"Device changed since it was cached - updating discovery")
+        if self.mqtt_client and self.mqtt_payloads:
+            self.mqtt_payloads = MQTTPayloads(device=self.device, discovery_mode=self.manager.discovery_mode)
+            hashes = await self.mqtt_client.publish_discovery(self.mqtt_payloads.discovery(), known=await self.known_discovery())
+            self.manager.state_store.save(f"discovery_{self.device.info['serial']}", hashes)
+
+    async def report_startup(self):
+        # Seconds from connecting to each handshake stage, once the first status arrived
+        await self.event_handlers.wait_for("first_status")
+        timings = self.event_handlers.timings
+        self.logger.info(f"Startup timings: {timings}")
+        
+        if self.mqtt_client and self.mqtt_payloads:
+            self.mqtt_client.publish(f"evseMQTT/{self.device.info['serial']}/startup", json.dumps(timings), 0, True)
+
+    async def known_discovery(self):
+        # The retained configs on the broker are authoritative - the local hash file covers brokers that
+        # don't allow subscribing to the discovery topics
+        serial = self.device.info['serial']
+        known = await self.mqtt_client.discovery_hashes(serial)
+
+        if known is None and self.manager.state_store:
+            known = self.manager.state_store.load(f"discovery_{serial}")
+
+        return known
+
+    async def run(self):
+        # The supervisor owns the connection - scanning, connecting, login, and reconnecting with backoff
+        self.supervisor = Supervisor(self.ble_manager, self.address, self.logger, prepare=self.prepare_session, session=self.start_session, on_state=self.link_state)
+        
+        if self.device.rssi:
+            self.rssi_task = asyncio.create_task(self.ble_manager.track_rssi(self.address))
+        
+        if self.manager.stats_interval:
+            self.stats_task = asyncio.create_task(self.report_stats(self.manager.stats_interval))
+        
+        self.dispatcher = asyncio.create_task(self.dispatch_commands())
+        try:
+            await self.supervisor.run()
+        finally:
+            # Nothing of the charger keeps running once its supervisor stopped
+            tasks = [task for task in (self.rssi_task, self.stats_task, self.dispatcher) if task]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.rssi_task = self.stats_task = self.dispatcher = None
+
+    async def report_stats(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.publish_stats()
+
+    def publish_stats(self):
+        # Command queue and response metrics, retained next to the link state - logged when there is no MQTT
+        stats = {"commands": self.ble_manager.queue.stats(), "responses": self.commands.responses.stats()}
+        
+        if self.mqtt_client and self.serial:
+            self.mqtt_client.publish(f"evseMQTT/{self.serial}/queue", json.dumps(stats), 0, True)
+        else:
+            self.logger.debug(f"Command queue: {stats}")
+
+    async def dispatch_commands(self):
+        while True:
+            client, userdata, message = await self.inbox.get()
+            try:
+                await self.mqtt_callback.delegate(client, userdata, message)
+            except Exception as e:
+                self.logger.error(f"Failed to handle command {message.payload}: {e}")
+
+    async def prepare_session(self):
+        # Before each connection attempt - nothing of a previous session keeps running
+        for task in self.session_tasks:
+            task.cancel()
+        self.session_tasks = []
+        
+        # Repeated failures move the charger to another adapter
+        adapters = self.manager.adapters
+        adapters.failed(self.address, self.supervisor.failures)
+        adapter = await adapters.place(self.address)
+        self.ble_manager.use_adapter(adapter, adapters.scanners[adapter])
+        
+        # What the charger reported last time - lets discovery and state go out before the handshake finished
+        device_cache = self.manager.device_cache
+        self.profile = device_cache.load(self.address) if device_cache else None
+        if self.profile:
+            device_cache.restore(self.profile, self.device)
+            self.ble_manager.known_uuids[self.address] = (self.profile["write_uuid"], self.profile["read_uuid"])
+
+    async def start_session(self):
+        # Runs once connected, until discovery is published
+        profile = self.profile
+        self.logger.info("Waiting for device initialization...")
+        
+        # The handshake itself is driven by the event handlers - this only waits for its stages
+        if profile:
+            self.logger.info(f"Device restored from cache with serial: {self.device.info['serial']}. Confirming in the background.")
+        else:
+            await self.event_handlers.wait_for("beacon")
+            self.logger.info(f"Device initialized with serial: {self.device.info['serial']}. Proceeding with login request.")
+        
+        self.serial = self.device.info['serial']
+        
+        # Reading the retained discovery configs only needs the serial - overlap it with the login
+        known = asyncio.create_task(self.known_discovery()) if self.mqtt_client and not self.discovered else None
+        
+        if not profile:
+            await self.event_handlers.wait_for("version")
+        
+        # Ensure that the following are true:
+        #   - the MQTT client is required
+        #   - discovery wasn't published yet for this charger
+        #   - the EVSE serial has been retrieved
+        #   - the EVSE software_version has been retrieved
+        if self.mqtt_client and not self.discovered and self.device.info['serial'] is not None and self.device.info['software_version'] is not None:
+            # Setup the MQTT payloads
+            self.mqtt_payloads = MQTTPayloads(device=self.device, discovery_mode=self.manager.discovery_mode)
+            
+            # Setup the MQTT callback function
+            self.mqtt_callback = MQTTCallback(device=self.device, commands=self.commands, command_expiry=self.manager.command_expiry, ready=self.event_handlers.stages["logged_in"], mqtt_client=self.mqtt_client)
+            
+            # Generate discovery payloads
+            discovery_payloads = self.mqtt_payloads.discovery()
+            
+            # Post discovery payloads, skipping entities whose config is already retained on the broker
+            hashes = await self.mqtt_client.publish_discovery(discovery_payloads, known=await known)
+            self.discovered = True
+            
+            if self.manager.state_store:
+                self.manager.state_store.save(f"discovery_{self.device.info['serial']}", hashes)
+            
+            # Subscribe to the command topic - the manager routes its messages to this charger
+            self.mqtt_client.subscribe(f"evseMQTT/{self.device.info['serial']}/command")
+        elif known:
+            known.cancel()
+        
+        # The configuration from the cache, until the charger reports it
+        if profile:
+            self.event_handlers.forward("config")
+        
+        if self.manager.device_cache:
+            self.session_tasks.append(asyncio.create_task(self.confirm_profile(profile)))
+        
+        self.event_handlers.reached("discovery")
+        self.session_tasks.append(asyncio.create_task(self.report_startup()))
+
+    def link_state(self, state):
+        # Availability follows the link, the supervisor metrics are retained next to it
+        if state == "streaming":
+            self.manager.adapters.connected(self.address)
+        
+        if not self.mqtt_payloads or self.serial is None:
+            return
+        
+        if state == "streaming":
+            self.mqtt_client.publish_availability(self.serial, "online")
+        elif state == "backoff":
+            self.mqtt_client.publish_availability(self.serial, "offline")
+        
+        stats = dict(self.supervisor.stats(), adapter=self.manager.adapters.label(self.ble_manager.adapter))
+        self.mqtt_client.publish(f"evseMQTT/{self.serial}/link", json.dumps(stats), 0, True)
+        
+        # What piled up while the link was down
+        if state == "streaming":
+            self.publish_stats()
 
-    async def run(self, address):
-        await self.ble_manager.scan()
+    def cleanup(self):
+        self.logger.info(f"Command queue: {self.ble_manager.queue.stats()}")
+        self.logger.info(f"Command responses: {self.commands.responses.stats()}")
+        
+        if self.supervisor:
+            self.logger.info(f"Link: {self.supervisor.stats()}")
         
-        self.logger.info(f"Connecting...")
+        if self.mqtt_client and self.serial:
+            self.mqtt_client.publish_availability(self.serial, "offline")
+
+class Manager:
+    def __init__(self, address, ble_password, unit, mqtt_enabled=False, mqtt_settings=None, logging_level=logging.INFO, rssi=False, publish_settings=None, state_dir=None, discovery_mode="entity", command_expiry=None, full_scan=False, chargers=None, adapters=None, adapter_capacity=4, stats_interval=60):
+        self.setup_logging(logging_level)
+        self.logger = logging.getLogger("evseMQTT")
+        debug = logging_level == logging.DEBUG  # Determine if debug logging is enabled
         
-        if await self.ble_manager.connect_device(address):
-            self.logger.info(f"Connected.")
+        self.discovery_mode = discovery_mode
+        self.command_expiry = command_expiry
+        self.full_scan = full_scan
+        self.stats_interval = stats_interval
+
+        # Optional directory for state kept across restarts
+        self.state_store = StateStore(state_dir, self.logger) if state_dir else None
+        self.device_cache = DeviceCache(self.state_store) if self.state_store else None
+
+        # The Bluetooth adapters the chargers are spread over, each with one scanner shared by its chargers
+        self.adapters = AdapterPool(self.logger, adapters=adapters, capacity=adapter_capacity)
+        self.adapters.on_change = self.adapter_load
+
+        self.mqtt_client = None
+        self.publisher = None
+
+        if mqtt_enabled and mqtt_settings:
+            # Only publish state that changed, if requested
+            publish_filter = PublishFilter(deadbands=publish_settings["deadbands"], max_silence=publish_settings["max_silence"]) if publish_settings and publish_settings.get("change_only") else None
+            
+            # Keep what is published while the broker is unreachable
+            mqtt_settings = dict(mqtt_settings)
+            spool_settings = mqtt_settings.pop("spool", None) or {}
+            spool = Spool(self.logger, path=state_dir, **spool_settings)
             
-            # Start the producer and consumer tasks
-            consumer = asyncio.create_task(self.ble_manager.message_consumer(address, self.ble_manager.write_uuid))
+            self.mqtt_client = MQTTClient(logger=self.logger, publish_filter=publish_filter, spool=spool, **mqtt_settings)
+            self.mqtt_client.on_reconnect = self.recover_mqtt
             
+            # Collect bursts of state updates and only publish the latest one per topic
+            if publish_settings and publish_settings.get("window"):
+                self.publisher = PublishCoalescer(self.mqtt_client.publish_state, window=publish_settings["window"], min_intervals=publish_settings.get("min_intervals"), logger=self.logger)
+
+        # A single charger from the arguments, or a list of them - each with its own logger when there are several
+        if chargers is None:
+            chargers = [{"address": address, "password": ble_password}]
+        
+        self.chargers = [
+            Charger(
+                self,
+                charger["address"],
+                ble_password=charger.get("password", ble_password),
+                unit=charger.get("unit", unit),
+                rssi=charger.get("rssi", rssi),
+                logger=self.logger if len(chargers) == 1 else logging.getLogger(f"evseMQTT.{charger['address']}"),
+            )
+            for charger in chargers
+        ]
+
+    def publish(self, identifier, topic, state):
+        # State updates of every charger go through the one MQTT connection
+        if self.publisher:
+            self.publisher.submit(identifier, topic, state)
+        elif self.mqtt_client:
+            self.mqtt_client.publish_state(identifier, topic, state)
+
+    def adapter_load(self):
+        if self.mqtt_client:
+            self.mqtt_client.publish("evseMQTT/adapters", json.dumps(self.adapters.stats()), 0, True)
+
+    async def route_command(self, client, userdata, message):
+        # evseMQTT/<serial>/command - handled by the charger with that serial
+        serial = message.topic.split("/")[1]
+        for charger in self.chargers:
+            if charger.serial == serial and charger.mqtt_callback:
+                charger.inbox.put_nowait((client, userdata, message))
+                return
+        
+        self.logger.warning(f"Ignoring command for unknown charger {serial}")
+
+    async def recover_mqtt(self):
+        await asyncio.gather(*(charger.recover_mqtt() for charger in self.chargers))
+
+    def setup_logging(self, logging_level):
+        logging.basicConfig(level=logging_level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    async def run(self, address=None):
+        # The MQTT client runs on this event loop, so it can only connect once the loop is running
+        if self.mqtt_client and self.mqtt_client.loop is None:
+            await self.mqtt_client.connect()
+            self.mqtt_client.set_on_message(self.route_command)
+
+        # Connecting looks the charger up by itself - a full scan only lists what is around
+        if self.full_scan:
             try:
-                self.logger.info("Waiting for device initialization...")
-                
-                while not self.device.initialization_state:
-                    self.logger.info(f"Device not initialized yet, waiting...")
-                    await asyncio.sleep(1)
-
-                self.logger.info(f"Device initialized with serial: {self.device.info['serial']}. Proceeding with login request.")
-                
-                if self.device.fallback:
-                    self.logger.info(f"Fallback: software_version populated with hardware_version.")
-                    self.device.info = {'software_version': self.device.info['hardware_version']}
-                
-                while self.device.info['software_version'] is None:
-                    self.logger.info(f"Waiting for software version...")
-                    await asyncio.sleep(1)
-                
-                # Ensure that the following are true:
-                #   - the MQTT client is required
-                #   - the MQTT client is not already connected
-                #   - the EVSE serial has been retrieved
-                #   - the EVSE software_version has been retrieved
-                if self.mqtt_client and not self.mqtt_client.connected and self.device.info['serial'] is not None and self.device.info['software_version'] is not None:
-                    # Setup the MQTT payloads
-                    self.mqtt_payloads = MQTTPayloads(device=self.device)
-                    
-                    # Setup the MQTT callback function
-                    self.mqtt_callback = MQTTCallback(device=self.device, commands=self.commands)
-                    
-                    # Generate discovery payloads
-                    discovery_payloads = self.mqtt_payloads.discovery()
-                    
-                    # Post discovery payloads
-                    self.mqtt_client.publish_discovery(discovery_payloads)
-                    
-                    # Subscribe to the command topic
-                    self.mqtt_client.subscribe(f"evseMQTT/{self.device.info['serial']}/command")
-                    
-                    # Setup the callback function for handling messages
-                    self.mqtt_client.set_on_message(self.mqtt_callback.delegate)
-                    
-                    # Post online to availability topic
-                    self.mqtt_client.publish_availability(self.device.info['serial'], "online")
-                
-                if self.device.rssi:
-                    heartbeat = asyncio.create_task(self.ble_manager.heartbeat(60, address))
-                
-                while True:                
-                    await asyncio.sleep(1)  # Example interval for ad-hoc message sending
-                    self.logger.debug(f"Idling...")
-
-            except (KeyboardInterrupt, SystemExit):
-                # Handling cleanup on keyboard interrupt
-                self.logger.info("Interrupted, cleaning up...")            
-                
-                # Wait for queue to be empty and disconnect the device
-                await self.ble_manager.queue.join()
-                await self.ble_manager.disconnect_device(address)
-            finally:
-                self.cleanup()
+                await self.chargers[0].ble_manager.scan()
+            except BleakError:
+                pass  # Logged by the scan - the chargers connect regardless
+            self.full_scan = False
+        
+        try:
+            await asyncio.gather(*(charger.run() for charger in self.chargers))
+        except (KeyboardInterrupt, SystemExit):
+            # Handling cleanup on keyboard interrupt
+            self.logger.info("Interrupted, cleaning up...")            
+            
+            # Wait for the queues to be empty and disconnect the devices
+            for charger in self.chargers:
+                await charger.ble_manager.queue.join()
+                await charger.ble_manager.disconnect_device(charger.address)
+        finally:
+            self.cleanup()
 
     def cleanup(self):
+        if self.publisher:
+            self.publisher.flush_all()
+        
+        for charger in self.chargers:
+            charger.cleanup()
+        
+        self.logger.info(f"Adapters: {self.adapters.stats()}")
+        
         if self.mqtt_client:
-            self.mqtt_client.publish_availability(self.device.info['serial'], "offline")
             self.mqtt_client.disconnect()
 
     def handle_exit(self, signum, frame):
@@ -128,24 +381,13 @@ class Manager:
         self.cleanup()
         sys.exit(0)
         
-    async def restart_run(self, address=None):
-        if address is None:
-            address = self.address
-        
-        self.logger.info("Restarting run function due to inactivity.")
-
-        # Reset initialization_state and software_version
-        self.device.initialization_state = False
-        self.device.logged_in = False
-        self.device.info = {'software_version': None, 'serial': None}
-        
-        await self.run(address)
-
     async def exit_with_error(self, error):
         self.logger.error(f"Error encountered:\n{error}")
         # Perform necessary cleanup actions
         if self.mqtt_client:
-            self.mqtt_client.publish_availability(self.device.info['serial'], "offline")
+            for charger in self.chargers:
+                if charger.serial:
+                    self.mqtt_client.publish_availability(charger.serial, "offline")
             self.mqtt_client.disconnect()
         
         tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
@@ -160,35 +402,83 @@ class Manager:
 
 def main():
     parser = argparse.ArgumentParser(description="BLE Manager")
-    parser.add_argument("--address", type=str, required=True, help="BLE device address")
-    parser.add_argument("--password", type=str, required=True, help="BLE device password")
+    parser.add_argument("--address", type=str, help="BLE device address, required unless --chargers is given")
+    parser.add_argument("--password", type=str, default="123456", help="BLE device password")
+    parser.add_argument("--chargers", type=str, help="JSON file listing several chargers to manage, as objects with address and optionally password, unit and rssi")
+    parser.add_argument("--adapters", type=str, help="Comma separated Bluetooth adapters to spread the chargers over, e.g. hci0,hci1. Default is every adapter found")
+    parser.add_argument("--adapter_capacity", type=int, default=4, help="Chargers connected through one adapter before the next one is used")
     parser.add_argument("--unit", type=str, default="W", help="Set the unit of measurement, for consumed power - kW or W")
     parser.add_argument("--mqtt", action='store_true', help="Enable MQTT")
     parser.add_argument("--mqtt_broker", type=str, help="MQTT broker address")
     parser.add_argument("--mqtt_port", type=int, help="MQTT broker port")
     parser.add_argument("--mqtt_user", type=str, help="MQTT username")
     parser.add_argument("--mqtt_password", type=str, help="MQTT password")
+    parser.add_argument("--mqtt_version", type=str, choices=["3.1.1", "5"], default="3.1.1", help="MQTT protocol version, 5 enables topic aliases and message expiry")
+    parser.add_argument("--command_expiry", type=float, default=60, help="Seconds after which a command that could not be sent to the charger is dropped, unless the MQTT v5 message sets its own expiry. 0 disables")
+    parser.add_argument("--stats_interval", type=float, default=60, help="Seconds between publishing the command queue metrics of each charger. 0 disables")
+    parser.add_argument("--spool_tail", action='store_true', help="While the broker is unreachable keep every message, not only the latest per topic")
+    parser.add_argument("--spool_size", type=int, default=256, help="Size in KiB of the spool for --spool_tail")
+    parser.add_argument("--scan", action='store_true', help="Scan for evse devices on start and log them, before connecting")
     parser.add_argument("--rssi", action='store_true', help="Monitor Received Signal Strength Indicator")
+    parser.add_argument("--change_only", action='store_true', help="Only publish state when it changed")
+    parser.add_argument("--max_silence", type=int, default=300, help="Publish unchanged state at least every N seconds, when --change_only is set")
+    parser.add_argument("--deadband", type=str, action='append', default=[], help="Minimum change for a field to be published, as field=value - e.g. l1_voltage=0.5. Can be repeated")
+    parser.add_argument("--publish_window", type=float, default=0.25, help="Seconds to collect state updates before publishing the latest one per topic, 0 disables")
+    parser.add_argument("--min_interval", type=str, action='append', default=[], help="Minimum seconds between two publishes of a state topic, as topic=seconds - e.g. charge=5. Can be repeated")
+    parser.add_argument("--json_backend", type=str, choices=["json", "orjson"], help="JSON library used for state payloads. Default is orjson when installed, otherwise json")
+    parser.add_argument("--discovery_mode", type=str, choices=["entity", "device"], default="entity", help="Home Assistant discovery as one message per entity, or a single device message per charger")
+    parser.add_argument("--state_dir", type=str, help="Directory for state kept across restarts, e.g. discovery hashes")
     parser.add_argument("--logging_level", type=str, default="INFO", help="Logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)")
     args = parser.parse_args()
+    
+    chargers = None
+    if args.chargers:
+        with open(args.chargers, encoding="utf-8") as file:
+            chargers = json.load(file)
+        
+        if not isinstance(chargers, list) or not chargers or not all(isinstance(charger, dict) and charger.get("address") for charger in chargers):
+            parser.error("--chargers must list objects with an address")
+    elif not args.address:
+        parser.error("--address is required unless --chargers is given")
 
     mqtt_settings = {
         "client_id": "evseMQTTClient",
         "broker": args.mqtt_broker,
         "port": args.mqtt_port,
         "username": args.mqtt_user,
-        "password": args.mqtt_password
+        "password": args.mqtt_password,
+        "serializer": StateSerializer(backend=args.json_backend),
+        "mqtt_version": args.mqtt_version,
+        "spool": {"capacity": args.spool_size * 1024, "tail": args.spool_tail}
     } if args.mqtt else None
     
+    deadbands = dict(Constants.PUBLISH_DEADBANDS)
+    for deadband in args.deadband:
+        field, value = deadband.split("=", 1)
+        deadbands[field.strip()] = float(value)
+    
+    min_intervals = {}
+    for min_interval in args.min_interval:
+        topic, value = min_interval.split("=", 1)
+        min_intervals[topic.strip()] = float(value)
+    
+    publish_settings = {
+        "change_only": args.change_only,
+        "deadbands": deadbands,
+        "max_silence": args.max_silence,
+        "window": args.publish_window,
+        "min_intervals": min_intervals
+    }
+    
     logging_level = getattr(logging, args.logging_level.upper(), logging.INFO)
-    manager = Manager(args.address, ble_password=args.password, unit=args.unit, mqtt_enabled=args.mqtt, mqtt_settings=mqtt_settings, rssi=args.rssi, logging_level=logging_level)
+    manager = Manager(args.address, ble_password=args.password, unit=args.unit, mqtt_enabled=args.mqtt, mqtt_settings=mqtt_settings, rssi=args.rssi, logging_level=logging_level, publish_settings=publish_settings, state_dir=args.state_dir, discovery_mode=args.discovery_mode, command_expiry=args.command_expiry, full_scan=args.scan, chargers=chargers, adapters=[adapter.strip() for adapter in args.adapters.split(",") if adapter.strip()] if args.adapters else None, adapter_capacity=args.adapter_capacity, stats_interval=args.stats_interval)
     
     # Register signal handlers for common termination signals
     signals = [signal.SIGINT, signal.SIGTERM, signal.SIGQUIT, signal.SIGABRT]
     for sig in signals:
         signal.signal(sig, manager.handle_exit)
     
-    asyncio.run(manager.run(args.address))
+    asyncio.run(manager.run())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file